@@ -1,10 +1,21 @@
 import streamlit as st
 import pandas as pd
-import sqlite3
 import os
-from datetime import datetime, date
+from datetime import date
 import time
-from fpdf import FPDF
+import tempfile
+from collections import namedtuple
+from repositorio import get_db, run_action, run_query, iter_query, inicializar_banco, importar, sugerir_duplicados, mesclar_duplicados
+from deduplicacao import ENTIDADES, LIMIAR
+from relatorios import LOGO_FILE, assinatura_registro, gerar_pdf, exportar_zip, exportar_pdf_unico
+from metricas import MAX_EVENTOS, coletor
+from normalizacao import data_iso, gravar_originais, normalizar
+from rastreabilidade import atualizar_lotes, ler_lista_lotes, procedimentos_por_lotes
+from consultas import (CADASTROS, TABELAS_REFERENCIA,
+                       SQL_REGISTRO, SQL_DASHBOARD_KPIS, SQL_DASHBOARD_TOP_HOSPITAIS, SQL_DASHBOARD_GENERO,
+                       SQL_LOOKUP_HOSPITAIS, SQL_LOOKUP_CADASTRO, SQL_OPCOES_HOSPITAIS, SQL_OPCOES_ESPECIALISTAS,
+                       POR_PAGINA, sql_consulta, sql_contagem, chave_pagina, marcadores, SQL_RASTREABILIDADE,
+                       SQL_ADMIN_IMPORTACOES, SQL_ADMIN_CIDADES, SQL_ADMIN_CIDADES_OPCOES, SQL_ADMIN_HOSPITAIS)
 
 # --- CONFIGURAÇÃO DA PÁGINA ---
 st.set_page_config(
@@ -15,10 +26,8 @@ st.set_page_config(
 )
 
 # --- CONSTANTES E ARQUIVOS ---
-ARQUIVO_DB = 'myval_dados.db'
-ARQUIVO_CSV = 'dados.csv' 
+PDF_CACHE_MAX = 64 # PDFs individuais mantidos em memória (os mais recentes)
 LOGO_URL_BACKUP = "https://cdn-icons-png.flaticon.com/512/3063/3063176.png"
-LOGO_FILE = "logo.png" # Salve o logo da Meril com este nome na pasta
 
 # --- ESTILIZAÇÃO CSS (PREMIUM) ---
 st.markdown("""
@@ -66,138 +75,73 @@ USERS = {
 }
 
 # --- FUNÇÕES DE BANCO DE DADOS ---
-def get_conn(): return sqlite3.connect(ARQUIVO_DB)
-
-def run_action(query, params=()):
-    conn = get_conn()
-    try:
-        conn.execute(query, params)
-        conn.commit()
-        return True, "Sucesso"
-    except Exception as e:
-        return False, str(e)
-    finally:
-        conn.close()
-
-def run_query(query, params=()):
-    with get_conn() as conn:
-        return pd.read_sql(query, conn, params=params)
+# Ficam em repositorio.py (sem Streamlit), compartilhadas com o cli.py
 
+# Roda uma vez por processo do servidor (não a cada rerun do Streamlit). Uma exceção não fica
+# em cache: com o banco travado por um job do cli.py, o próximo rerun tenta de novo.
+@st.cache_resource(show_spinner=False)
 def inicializar_e_migrar():
-    conn = get_conn()
-    c = conn.cursor()
-    # Tabelas
-    c.execute("CREATE TABLE IF NOT EXISTS cidades (id INTEGER PRIMARY KEY, nome TEXT, estado TEXT, UNIQUE(nome, estado))")
-    c.execute("CREATE TABLE IF NOT EXISTS hospitais (id INTEGER PRIMARY KEY, nome TEXT, cidade_id INTEGER, FOREIGN KEY(cidade_id) REFERENCES cidades(id), UNIQUE(nome, cidade_id))")
-    for t in ["distribuidores", "especialistas", "proctors", "operadores"]:
-        c.execute(f"CREATE TABLE IF NOT EXISTS {t} (id INTEGER PRIMARY KEY, nome TEXT UNIQUE)")
-    
-    c.execute("""CREATE TABLE IF NOT EXISTS procedimentos (
-            id INTEGER PRIMARY KEY, data_proc DATE, paciente TEXT, idade TEXT, genero TEXT,
-            hospital_id INTEGER, distribuidor_id INTEGER, specialist_id INTEGER, proctor_id INTEGER,
-            op1_id INTEGER, op2_id INTEGER, report_status TEXT, proctor_form TEXT, overnight_stay TEXT, proctor_eco TEXT,
-            team_status TEXT, anatomical_details TEXT, access_type TEXT, offlabel_form_anatomia TEXT, offlabel_form_acesso TEXT,
-            myval_size TEXT, sn_protese TEXT, navigator_model TEXT, navigator_lot TEXT, mammoth_model TEXT, mammoth_lot TEXT,
-            val_crimp_lot TEXT, phyton_lot TEXT, guidewire TEXT, comentarios TEXT, FOREIGN KEY(hospital_id) REFERENCES hospitais(id))""")
-    conn.commit()
-    
-    # Importação CSV (Lógica mantida resumida)
-    try:
-        if c.execute("SELECT count(*) FROM procedimentos").fetchone()[0] == 0 and os.path.exists(ARQUIVO_CSV):
-            df = pd.read_csv(ARQUIVO_CSV, sep=None, engine='python', dtype=str, encoding='utf-8')
-            df.columns = df.columns.str.strip()
-            df = df.apply(lambda x: x.str.strip() if x.dtype == "object" else x).fillna('')
-            
-            # Cidades/Hospitais
-            for _, r in df[['City', 'State']].drop_duplicates().iterrows():
-                if r['City']: c.execute("INSERT OR IGNORE INTO cidades (nome, estado) VALUES (?, ?)", (r['City'], r['State']))
-            for _, r in df[['Hospital', 'City', 'State']].drop_duplicates().iterrows():
-                if r['Hospital']:
-                    res = c.execute("SELECT id FROM cidades WHERE nome=? AND estado=?", (r['City'], r['State'])).fetchone()
-                    if res: c.execute("INSERT OR IGNORE INTO hospitais (nome, cidade_id) VALUES (?, ?)", (r['Hospital'], res[0]))
-            
-            # Pessoas
-            mapa = {'Distributor/Meril': 'distribuidores', 'Proctor': 'proctors', 'Specialist / Crimper': 'especialistas', '1st operator': 'operadores', '2st operator': 'operadores'}
-            for col, tab in mapa.items():
-                if col in df.columns:
-                    for val in df[col].unique():
-                        if val: c.execute(f"INSERT OR IGNORE INTO {tab} (nome) VALUES (?)", (val,))
-            conn.commit()
-            
-            # Procedimentos
-            for _, row in df.iterrows():
-                def get_id(tbl, val):
-                    r = c.execute(f"SELECT id FROM {tbl} WHERE nome=?", (val,)).fetchone()
-                    return r[0] if r else None
-                def get_hosp(h, city, uf):
-                    r = c.execute("SELECT h.id FROM hospitais h JOIN cidades c ON h.cidade_id=c.id WHERE h.nome=? AND c.nome=? AND c.estado=?", (h, city, uf)).fetchone()
-                    return r[0] if r else None
-                
-                c.execute("""INSERT INTO procedimentos (data_proc, paciente, idade, genero, hospital_id, distribuidor_id, specialist_id, proctor_id, op1_id, op2_id, report_status, proctor_form, overnight_stay, proctor_eco, team_status, anatomical_details, access_type, offlabel_form_anatomia, offlabel_form_acesso, myval_size, sn_protese, navigator_model, navigator_lot, mammoth_model, mammoth_lot, val_crimp_lot, phyton_lot, guidewire, comentarios) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)""", (
-                    row.get('Data'), row.get('Patient'), row.get('Age'), row.get('Gender'), get_hosp(row.get('Hospital'), row.get('City'), row.get('State')), get_id('distribuidores', row.get('Distributor/Meril')), get_id('especialistas', row.get('Specialist / Crimper')), get_id('proctors', row.get('Proctor')), get_id('operadores', row.get('1st operator')), get_id('operadores', row.get('2st operator')), row.get('Report'), row.get('Proctor Form'), row.get('Overnight stay'), row.get('Proctor - ECO'), row.get('Team Status'), row.get('Anatomical details'), row.get('Access'), row.get('Offlabel form'), row.get('Offlabel form.1'), row.get('Myval Size'), row.get('SN'), row.get('Navigator'), row.get('Lot'), row.get('Mammoth'), row.get('Lot.1'), row.get('Val de Crimp - Lot'), row.get('Phyton - Lot'), row.get('Guidewire'), row.get('Comments')))
-            conn.commit()
-    except: pass
-    conn.close()
-
-inicializar_e_migrar()
-
-# --- FUNÇÃO GERADORA DE PDF ---
-class PDF(FPDF):
-    def header(self):
-        # Logo
-        if os.path.exists(LOGO_FILE):
-            self.image(LOGO_FILE, 10, 8, 33)
-        self.set_font('Arial', 'B', 15)
-        self.set_text_color(0, 59, 115) # Azul Meril
-        self.cell(80)
-        self.cell(30, 10, 'Relatório de Procedimento Cirúrgico', 0, 0, 'C')
-        self.ln(20)
-
-    def footer(self):
-        self.set_y(-15)
-        self.set_font('Arial', 'I', 8)
-        self.set_text_color(128)
-        self.cell(0, 10, 'Meril Life Sciences - Surgical Intelligence System | Página ' + str(self.page_no()), 0, 0, 'C')
-
-def gerar_pdf(dados_dict):
-    pdf = PDF()
-    pdf.add_page()
-    pdf.set_auto_page_break(auto=True, margin=15)
-    
-    # Título do Paciente
-    pdf.set_fill_color(0, 174, 239) # Azul Ciano
-    pdf.set_text_color(255, 255, 255)
-    pdf.set_font("Arial", "B", 12)
-    pdf.cell(0, 10, f" Protocolo #{dados_dict['id']} - Paciente: {dados_dict['paciente']} ({dados_dict['data_proc']})", 0, 1, 'L', fill=True)
-    pdf.ln(5)
-
-    # Corpo
-    pdf.set_text_color(0, 0, 0)
-    pdf.set_font("Arial", "", 10)
-    
-    colunas = [
-        ("Hospital", dados_dict['Hospital']), ("Cidade/UF", dados_dict['Cidade'] + "/" + dados_dict['UF']),
-        ("Especialista", dados_dict['Especialista']), ("Proctor", dados_dict['Proctor']),
-        ("MyVal Size", dados_dict['myval_size']), ("Serial Number", dados_dict['sn_protese']),
-        ("Team Status", dados_dict['team_status']), ("Anatomia", dados_dict['anatomical_details'])
-    ]
-    
-    for label, valor in colunas:
-        pdf.set_font("Arial", "B", 10)
-        pdf.cell(40, 8, label + ":", 0, 0)
-        pdf.set_font("Arial", "", 10)
-        pdf.multi_cell(0, 8, str(valor) if valor else "-")
-        
-    pdf.ln(5)
-    pdf.set_font("Arial", "B", 11)
-    pdf.cell(0, 10, "Comentários Clínicos:", 0, 1)
-    pdf.set_font("Arial", "", 10)
-    pdf.multi_cell(0, 6, str(dados_dict['comentarios']) if dados_dict['comentarios'] else "Sem observações adicionais.")
-    
-    # Salva em memória temporária
-    return pdf.output(dest="S").encode("latin-1")
+    return inicializar_banco()
+
+# Opções de um selectbox: ids na ordem de exibição + dicionários id->rótulo e id->posição (O(1))
+Lookup = namedtuple("Lookup", "ids rotulos posicoes")
+
+def montar_lookup(df, col_rotulo):
+    ids = df['id'].tolist()
+    return Lookup(ids, dict(zip(ids, df[col_rotulo].tolist())), {i: p for p, i in enumerate(ids)})
+
+# Dados de referência do formulário, compartilhados por todas as sessões.
+# 'versao' é só a chave do cache: muda quando run_action grava numa dessas tabelas.
+@st.cache_resource(show_spinner=False, max_entries=4)
+def carregar_referencias(versao):
+    hosp = run_query(SQL_LOOKUP_HOSPITAIS)
+    hosp['l'] = hosp['nome'] + " (" + hosp['loc'] + ")"
+    ref = {t: montar_lookup(run_query(SQL_LOOKUP_CADASTRO.format(tabela=t)), 'nome') for t in CADASTROS}
+    ref["hospitais"] = montar_lookup(hosp, 'l')
+    return ref
+
+def referencias(): return carregar_referencias(get_db().versao(*TABELAS_REFERENCIA))
+
+# Opções dos filtros da Consulta (DISTINCT no banco), refeitas quando procedimentos ou cadastros mudam
+@st.cache_resource(show_spinner=False, max_entries=4)
+def carregar_opcoes_consulta(versao):
+    return {"hospitais": run_query(SQL_OPCOES_HOSPITAIS)['nome'].tolist(),
+            "especialistas": run_query(SQL_OPCOES_ESPECIALISTAS)['nome'].tolist()}
+
+def opcoes_consulta(): return carregar_opcoes_consulta(get_db().versao("procedimentos", "hospitais", "especialistas"))
+
+# Total do filtro para os relatórios em lote: a contagem percorre a tabela, então só refaz quando os dados mudam
+@st.cache_resource(show_spinner=False, max_entries=16)
+def carregar_contagem(filtros, versao):
+    return int(run_query(*sql_contagem(*filtros))['n'].iloc[0])
+
+def contagem_consulta(filtros): return carregar_contagem(filtros, get_db().versao("procedimentos", "hospitais", "especialistas"))
+
+# PDF de um procedimento: chave = (id, assinatura dos campos impressos), então editar o registro gera outro.
+# '_dados' fica fora da chave (prefixo _); LRU limitado a PDF_CACHE_MAX documentos no processo.
+@st.cache_resource(show_spinner=False, max_entries=PDF_CACHE_MAX)
+def pdf_em_cache(rid, assinatura, _dados):
+    return gerar_pdf(_dados)
+
+# Sugestões de mesclagem: refeitas quando algum cadastro ou procedimento muda
+@st.cache_resource(show_spinner=False, max_entries=8)
+def carregar_duplicados(tabela, limiar, versao):
+    return sugerir_duplicados(tabela, limiar)
+
+def pdf_do_registro(dados): return pdf_em_cache(int(dados['id']), assinatura_registro(dados), dados)
+
+try:
+    res_import = inicializar_e_migrar()
+except Exception as e:
+    # Sem as migrações o esquema fica desatualizado (formulário e busca falhariam): não segue
+    st.error(f"Falha ao preparar o banco de dados: {e}. Recarregue a página para tentar de novo.")
+    st.stop()
+if res_import and not st.session_state.get('aviso_importacao'):
+    st.session_state['aviso_importacao'] = True
+    st.toast(res_import.resumo(), icon="📥")
+    if res_import.rejeitados:
+        st.warning("Linhas rejeitadas na importação: " + "; ".join(f"linha {l}: {m}" for l, m in res_import.rejeitados[:20]))
 
-# --- INTERFACE DE LOGIN ---
 def login_screen():
     c1, c2, c3 = st.columns([1,2,1])
     with c2:
@@ -227,14 +171,11 @@ def login_screen():
 
 # --- HELPERS ---
 def parse_data(d):
-    if not d: return date.today()
-    for f in ('%Y-%m-%d', '%d/%m/%Y', '%Y/%m/%d'):
-        try: return datetime.strptime(d, f).date()
-        except: continue
-    return date.today()
+    iso = data_iso(d)
+    return date.fromisoformat(iso) if iso else date.today()
 
 def load_reg(id):
-    df = run_query("SELECT * FROM procedimentos WHERE id = ?", (id,))
+    df = run_query(SQL_REGISTRO, (id,))
     return df.iloc[0] if not df.empty else None
 
 def reset_form():
@@ -260,7 +201,7 @@ else:
         st.divider()
         
         # Menu
-        opt_map = {"Dashboard": "📊 Dashboard", "Novo": "📝 Novo Registro", "Consulta": "🔍 Base de Dados", "Admin": "⚙️ Configurações"}
+        opt_map = {"Dashboard": "📊 Dashboard", "Novo": "📝 Novo Registro", "Consulta": "🔍 Base de Dados", "Rastreio": "🧬 Rastreabilidade", "Admin": "⚙️ Configurações"}
         
         # Bloqueia Admin para usuários comuns
         if st.session_state['role'] != 'admin':
@@ -280,6 +221,8 @@ else:
         if sel == "Novo" and st.session_state['modo_visualizacao']: reset_form()
         st.rerun()
 
+    inicio_pagina = time.perf_counter()
+
     # --- DASHBOARD ---
     if st.session_state['pagina_ativa'] == "Dashboard":
         st.title("Business Intelligence")
@@ -289,32 +232,25 @@ else:
         ini = c_d1.date_input("Data Início", date(2024,1,1))
         fim = c_d2.date_input("Data Fim", date.today())
         
-        df = run_query("""
-            SELECT p.data_proc, h.nome as hospital, d.nome as distribuidor, p.genero, s.nome as especialista, p.team_status
-            FROM procedimentos p
-            LEFT JOIN hospitais h ON p.hospital_id = h.id
-            LEFT JOIN distribuidores d ON p.distribuidor_id = d.id
-            LEFT JOIN especialistas s ON p.specialist_id = s.id
-            WHERE p.data_proc BETWEEN ? AND ?
-        """, (ini, fim))
+        kpi = run_query(SQL_DASHBOARD_KPIS, (ini, fim)).iloc[0]
         
-        if df.empty:
+        if kpi['procedimentos'] == 0:
             st.info("Sem dados para o período selecionado.")
         else:
             k1, k2, k3, k4 = st.columns(4)
-            k1.metric("Procedimentos", len(df))
-            k2.metric("Hospitais Ativos", df['hospital'].nunique())
-            k3.metric("Certificados", len(df[df['team_status']=='Certified']))
-            k4.metric("Market Share (Meril)", f"{len(df[df['distribuidor'].str.contains('Meril', na=False, case=False)])}")
+            k1.metric("Procedimentos", int(kpi['procedimentos']))
+            k2.metric("Hospitais Ativos", int(kpi['hospitais']))
+            k3.metric("Certificados", int(kpi['certificados']))
+            k4.metric("Market Share (Meril)", f"{int(kpi['meril'])}")
             
             st.divider()
             c1, c2 = st.columns([2, 1])
             with c1:
                 st.subheader("Top Hospitais")
-                st.bar_chart(df['hospital'].value_counts().head(8), color="#003B73")
+                st.bar_chart(run_query(SQL_DASHBOARD_TOP_HOSPITAIS, (ini, fim)).set_index('hospital')['n'], color="#003B73")
             with c2:
                 st.subheader("Gênero")
-                st.bar_chart(df['genero'].value_counts(), color="#00AEEF")
+                st.bar_chart(run_query(SQL_DASHBOARD_GENERO, (ini, fim)).set_index('genero')['n'], color="#00AEEF")
 
     # --- NOVO / FORMULÁRIO ---
     elif st.session_state['pagina_ativa'] == "Novo":
@@ -332,17 +268,13 @@ else:
 
         st.title(header)
         
-        # Lookups
-        hosp = run_query("SELECT h.id, h.nome, c.nome||'/'||c.estado as loc FROM hospitais h JOIN cidades c ON h.cidade_id=c.id ORDER BY h.nome")
-        hosp['l'] = hosp['nome'] + " (" + hosp['loc'] + ")" if not hosp.empty else []
-        specs = run_query("SELECT * FROM especialistas ORDER BY nome")
-        procs = run_query("SELECT * FROM proctors ORDER BY nome")
-        ops = run_query("SELECT * FROM operadores ORDER BY nome")
-        dists = run_query("SELECT * FROM distribuidores ORDER BY nome")
+        # Lookups (cache compartilhado, sem ida ao banco enquanto os cadastros não mudam)
+        ref = referencias()
+        hosp, specs, procs, ops, dists = ref["hospitais"], ref["especialistas"], ref["proctors"], ref["operadores"], ref["distribuidores"]
 
         # Helpers Seguros
         def val(k): return dados[k] if (dados is not None and dados[k]) else ""
-        def idx(df, c, k): return df[c].tolist().index(int(dados[k])) if (dados is not None and dados[k]) else None
+        def idx(lk, k): return lk.posicoes.get(int(dados[k])) if (dados is not None and pd.notna(dados[k]) and dados[k] != '') else None
         def idx_l(l, k): return l.index(dados[k]) if (dados is not None and dados[k] in l) else None
 
         with st.form("meril_form"):
@@ -355,18 +287,18 @@ else:
             f_gn = c4.selectbox("Gênero", ["Male", "Female"], index=idx_l(["Male", "Female"], 'genero'), disabled=bloq)
             
             c5, c6 = st.columns(2)
-            f_hp = c5.selectbox("Hospital", hosp['id'], format_func=lambda x: hosp[hosp['id']==x]['l'].values[0] if not hosp.empty else "", index=idx(hosp, 'id', 'hospital_id'), disabled=bloq)
-            f_ds = c6.selectbox("Distribuidor", dists['id'], format_func=lambda x: dists[dists['id']==x]['nome'].values[0] if not dists.empty else "", index=idx(dists, 'id', 'distribuidor_id'), disabled=bloq)
+            f_hp = c5.selectbox("Hospital", hosp.ids, format_func=hosp.rotulos.get, index=idx(hosp, 'hospital_id'), disabled=bloq)
+            f_ds = c6.selectbox("Distribuidor", dists.ids, format_func=dists.rotulos.get, index=idx(dists, 'distribuidor_id'), disabled=bloq)
 
             st.markdown("#### Equipe")
             e1, e2, e3 = st.columns(3)
-            f_sp = e1.selectbox("Especialista", specs['id'], format_func=lambda x: specs[specs['id']==x]['nome'].values[0], index=idx(specs, 'id', 'specialist_id'), disabled=bloq)
-            f_pr = e2.selectbox("Proctor", procs['id'], format_func=lambda x: procs[procs['id']==x]['nome'].values[0], index=idx(procs, 'id', 'proctor_id'), disabled=bloq)
+            f_sp = e1.selectbox("Especialista", specs.ids, format_func=specs.rotulos.get, index=idx(specs, 'specialist_id'), disabled=bloq)
+            f_pr = e2.selectbox("Proctor", procs.ids, format_func=procs.rotulos.get, index=idx(procs, 'proctor_id'), disabled=bloq)
             f_tm = e3.selectbox("Status", ["Certified", "Not Certified", "Proctoring"], index=idx_l(["Certified", "Not Certified", "Proctoring"], 'team_status'), disabled=bloq)
             
             e4, e5 = st.columns(2)
-            f_o1 = e4.selectbox("1º Op", ops['id'], format_func=lambda x: ops[ops['id']==x]['nome'].values[0], index=idx(ops, 'id', 'op1_id'), disabled=bloq)
-            f_o2 = e5.selectbox("2º Op", ops['id'], format_func=lambda x: ops[ops['id']==x]['nome'].values[0], index=idx(ops, 'id', 'op2_id'), disabled=bloq)
+            f_o1 = e4.selectbox("1º Op", ops.ids, format_func=ops.rotulos.get, index=idx(ops, 'op1_id'), disabled=bloq)
+            f_o2 = e5.selectbox("2º Op", ops.ids, format_func=ops.rotulos.get, index=idx(ops, 'op2_id'), disabled=bloq)
 
             with st.expander("Detalhes Técnicos", expanded=False):
                 cl1, cl2 = st.columns(2)
@@ -392,8 +324,14 @@ else:
             
             if btn and not bloq:
                 v_pf = "Yes" if f_pf else "No"
-                ok, m = run_action("""INSERT INTO procedimentos (data_proc, paciente, idade, genero, hospital_id, distribuidor_id, specialist_id, proctor_id, op1_id, op2_id, team_status, report_status, proctor_form, access_type, anatomical_details, myval_size, sn_protese, navigator_lot, mammoth_lot, guidewire, comentarios) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)""", 
-                                   (f_dt, f_pc, f_id, f_gn, f_hp, f_ds, f_sp, f_pr, f_o1, f_o2, f_tm, f_rp, v_pf, f_ac, f_an, f_my, f_sn, f_nl, f_ml, f_gw, f_ob))
+                # Mesma normalização da importação (data ISO, idade/tamanho numéricos, categorias canônicas)
+                reg, originais = normalizar(dict(zip(
+                    ["data_proc", "paciente", "idade", "genero", "hospital_id", "distribuidor_id", "specialist_id", "proctor_id", "op1_id", "op2_id", "team_status", "report_status", "proctor_form", "access_type", "anatomical_details", "myval_size", "sn_protese", "navigator_lot", "mammoth_lot", "guidewire", "comentarios"],
+                    [f_dt, f_pc, f_id, f_gn, f_hp, f_ds, f_sp, f_pr, f_o1, f_o2, f_tm, f_rp, v_pf, f_ac, f_an, f_my, f_sn, f_nl, f_ml, f_gw, f_ob])))
+                def depois(conn, cur):
+                    atualizar_lotes(conn, [cur.lastrowid])
+                    gravar_originais(conn, [(cur.lastrowid, originais)])
+                ok, m = run_action(f"INSERT INTO procedimentos ({', '.join(reg)}) VALUES ({marcadores(reg)})", tuple(reg.values()), depois=depois)
                 if ok: st.toast("Salvo!", icon="✅"); time.sleep(1); st.rerun()
                 else: st.error(m)
 
@@ -401,34 +339,38 @@ else:
     elif st.session_state['pagina_ativa'] == "Consulta":
         st.title("Consulta & Relatórios")
         
-        # Query mais completa para o PDF
-        df = run_query("""
-            SELECT p.id, p.data_proc, p.paciente, h.nome as Hospital, c.nome as Cidade, c.estado as UF,
-                   s.nome as Especialista, pr.nome as Proctor, p.team_status, p.myval_size, p.sn_protese, p.anatomical_details, p.comentarios
-            FROM procedimentos p 
-            LEFT JOIN hospitais h ON p.hospital_id = h.id 
-            LEFT JOIN cidades c ON h.cidade_id = c.id
-            LEFT JOIN especialistas s ON p.specialist_id = s.id 
-            LEFT JOIN proctors pr ON p.proctor_id = pr.id
-            ORDER BY p.data_proc DESC
-        """)
-        
         with st.sidebar:
             st.markdown("---")
             st.subheader("Filtros")
-            search = st.text_input("Buscar")
-            fh = st.multiselect("Hospital", df['Hospital'].dropna().unique())
-            fs = st.multiselect("Especialista", df['Especialista'].dropna().unique())
+            search = st.text_input("Buscar", help="Paciente, comentários, anatomia, acesso ou guidewire. Sem acentos e por início de palavra: \"pos dilat\".")
+            fh = st.multiselect("Hospital", opcoes_consulta()["hospitais"])
+            fs = st.multiselect("Especialista", opcoes_consulta()["especialistas"])
+        
+        # Paginação por chave: guarda o (data_proc, id) de início de cada página visitada
+        filtros = (search, tuple(fh), tuple(fs))
+        if st.session_state.get('consulta_filtros') != filtros:
+            st.session_state['consulta_filtros'] = filtros
+            st.session_state['consulta_paginas'] = [None]
+        paginas = st.session_state['consulta_paginas']
         
-        if search: df = df[df['paciente'].str.contains(search, case=False, na=False)]
-        if fh: df = df[df['Hospital'].isin(fh)]
-        if fs: df = df[df['Especialista'].isin(fs)]
+        # Query mais completa para o PDF (uma linha a mais só para saber se há próxima página)
+        sql, params = sql_consulta(*filtros, apos=paginas[-1], limite=POR_PAGINA + 1)
+        df = run_query(sql, params)
+        tem_proxima = len(df) > POR_PAGINA
+        df = df.iloc[:POR_PAGINA]
         
         # Display Tabela Resumida
         st.dataframe(df[['id', 'data_proc', 'paciente', 'Hospital', 'Especialista', 'myval_size']], 
                      use_container_width=True, hide_index=True, 
                      column_config={"data_proc": st.column_config.DateColumn("Data", format="DD/MM/YYYY")})
         
+        n1, n2, n3 = st.columns([1, 2, 1])
+        if n1.button("◀ Anterior", disabled=len(paginas) == 1):
+            paginas.pop(); st.rerun()
+        n2.caption(f"Página {len(paginas)}")
+        if n3.button("Próxima ▶", disabled=not tem_proxima):
+            paginas.append(chave_pagina(df.iloc[-1])); st.rerun()
+        
         st.divider()
         c1, c2, c3 = st.columns([1, 2, 2])
         
@@ -446,37 +388,140 @@ else:
         with c3:
             # Geração de PDF
             if rid:
+                # Só renderiza quando o usuário clica (data como função), e sem rerun da página no download
                 reg_pdf = df[df['id'] == rid].iloc[0].to_dict()
-                try:
-                    pdf_bytes = gerar_pdf(reg_pdf)
-                    st.download_button("📄 Baixar PDF Cirúrgico", data=pdf_bytes, file_name=f"Relatorio_{rid}.pdf", mime="application/pdf", type="primary")
-                except Exception as e:
-                    st.error(f"Erro ao gerar PDF: {e}. Instale fpdf.")
+                st.download_button("📄 Baixar PDF Cirúrgico", data=lambda: pdf_do_registro(reg_pdf), file_name=f"Relatorio_{rid}.pdf",
+                                   mime="application/pdf", type="primary", on_click="ignore")
+        
+        # Relatórios de todos os procedimentos do filtro atual (não só da página)
+        with st.expander("📦 Relatórios em lote (filtro atual)"):
+            sql_lote, params_lote = sql_consulta(*filtros, limite=None)
+            total = contagem_consulta(filtros)
+            formato = st.radio("Formato", ["ZIP (um PDF por procedimento)", "PDF único"], horizontal=True)
+            if st.button(f"Gerar {total} relatório(s)", disabled=total == 0):
+                barra = st.progress(0.0, text="Gerando relatórios...")
+                # Um registro salvo depois da contagem também entra no lote: n pode passar de total
+                def progresso(n): barra.progress(min(n / total, 1.0), text=f"{n}/{max(n, total)}")
+                with tempfile.TemporaryFile() as arq:
+                    if formato.startswith("ZIP"):
+                        erros = exportar_zip(iter_query(sql_lote, params_lote), arq, progresso=progresso)
+                        nome, mime = "Relatorios.zip", "application/zip"
+                    else:
+                        exportar_pdf_unico(iter_query(sql_lote, params_lote), arq, progresso=progresso)
+                        erros = {}
+                        nome, mime = "Relatorios.pdf", "application/pdf"
+                    arq.seek(0)
+                    st.download_button(f"⬇️ Baixar {nome}", data=arq.read(), file_name=nome, mime=mime, type="primary", on_click="ignore")
+                if erros:
+                    st.warning(f"{len(erros)} relatório(s) com erro (listados em erros.txt): " + ", ".join(map(str, list(erros)[:20])))
+
+    # --- RASTREABILIDADE (RECALL) ---
+    elif st.session_state['pagina_ativa'] == "Rastreio":
+        st.title("Rastreabilidade de Lotes")
+        txt = st.text_area("Lotes / Números de Série", height=160, help="Cole a lista do aviso de recall: um lote por linha (ou separados por vírgula).")
+        lotes = ler_lista_lotes(txt)
+        
+        if lotes:
+            with get_db().leitura() as conn, coletor.consulta(conn, SQL_RASTREABILIDADE, (lotes,)) as m:
+                res = procedimentos_por_lotes(conn, lotes)
+                m["linhas"] = len(res)
+            sem_ocorrencia = sorted(set(lotes) - set(res['lote']))
+            
+            k1, k2, k3, k4 = st.columns(4)
+            k1.metric("Procedimentos Expostos", res['procedimento_id'].nunique())
+            k2.metric("Hospitais", res['hospital'].nunique())
+            k3.metric("Operadores", len(set(res['operador_1'].dropna()) | set(res['operador_2'].dropna())))
+            k4.metric("Lotes sem Ocorrência", len(sem_ocorrencia))
+            
+            st.dataframe(res, use_container_width=True, hide_index=True,
+                         column_config={"data_proc": st.column_config.DateColumn("Data", format="DD/MM/YYYY")})
+            st.download_button("📥 Exportar CSV", data=res.to_csv(index=False).encode('utf-8'), file_name="rastreabilidade_lotes.csv", mime="text/csv")
+            if sem_ocorrencia:
+                with st.expander(f"Lotes sem ocorrência ({len(sem_ocorrencia)})"):
+                    st.write(", ".join(sem_ocorrencia))
 
     # --- ADMIN ---
     elif st.session_state['pagina_ativa'] == "Admin":
         st.title("Gestão de Cadastros")
         
-        opt = st.selectbox("Tabela", ["Cidades", "Hospitais", "Especialistas", "Proctors", "Operadores"])
+        opt = st.selectbox("Tabela", ["Cidades", "Hospitais", "Especialistas", "Proctors", "Operadores", "Duplicados", "Importação", "Desempenho"])
         
-        if opt == "Cidades":
+        if opt == "Importação":
+            st.caption("Envie a exportação mais recente: procedimentos já existentes (mesmo SN e data) são atualizados só se mudaram.")
+            arq = st.file_uploader("Planilha (CSV ou XLSX)", type=["csv", "xlsx"])
+            if arq is not None and st.button("Importar", type="primary"):
+                try:
+                    if arq.name.lower().endswith(".xlsx"):
+                        with st.status("Importando planilha...") as status:
+                            res = importar(arq, progresso=lambda aba, n: status.write(f"Aba **{aba}**: {n} linhas lidas"))
+                    else:
+                        res = importar(arq)
+                    st.success(res.resumo())
+                    for l, m in res.rejeitados[:50]: st.caption(f"Linha {l}: {m}")
+                except Exception as e:
+                    st.error(f"Falha na importação: {e}")
+            st.dataframe(run_query(SQL_ADMIN_IMPORTACOES), hide_index=True)
+
+        elif opt == "Duplicados":
+            st.caption("Nomes parecidos (acentos, caixa, pontuação, espaços, pequenos erros de digitação). Ao mesclar, "
+                       "mantém o cadastro mais usado: os procedimentos dos demais passam a apontar para ele e eles são apagados.")
+            if st.session_state.get('msg_mesclagem'): st.success(st.session_state.pop('msg_mesclagem'))
+            d1, d2 = st.columns([2, 1])
+            tab = d1.selectbox("Cadastro", list(ENTIDADES), format_func=str.capitalize)
+            lim = d2.slider("Similaridade mínima", 0.5, 1.0, LIMIAR, 0.05)
+            versao = get_db().versao(*TABELAS_REFERENCIA, "procedimentos")
+            grupos = carregar_duplicados(tab, lim, versao)
+            if not grupos:
+                st.info("Nenhum duplicado encontrado.")
+            else:
+                sug = pd.DataFrame([{"Mesclar": False, "Local": g.local, "Manter": g.nomes[g.manter],
+                                     "Remover": " | ".join(g.nomes[i] for i in g.remover),
+                                     "Similaridade": g.similaridade, "Referências": sum(g.usos.values())} for g in grupos])
+                # A chave muda com a versão: marcações antigas não caem em grupos que mudaram depois de uma mesclagem
+                ed = st.data_editor(sug, hide_index=True, use_container_width=True, key=f"dup_{tab}_{lim}_{versao}",
+                                    column_order=["Mesclar"] + (["Local"] if ENTIDADES[tab][0] else []) + ["Manter", "Remover", "Similaridade", "Referências"],
+                                    disabled=["Local", "Manter", "Remover", "Similaridade", "Referências"])
+                escolhidos = [g for g, m in zip(grupos, ed["Mesclar"]) if m]
+                if st.button(f"Mesclar selecionados ({len(escolhidos)})", type="primary", disabled=not escolhidos):
+                    try:
+                        st.session_state['msg_mesclagem'] = f"{mesclar_duplicados(tab, escolhidos)} cadastros mesclados"
+                        st.rerun()
+                    except Exception as e:
+                        st.error(f"Falha na mesclagem: {e}")
+
+        elif opt == "Desempenho":
+            st.caption(f"Tempos deste processo (últimos {MAX_EVENTOS} eventos). Histórico completo em {coletor.arquivo}.")
+            coletor.limiar_ms = st.number_input("Limiar de consulta lenta (ms)", min_value=1.0, value=float(coletor.limiar_ms), step=50.0,
+                                                help="Consultas acima do limiar são registradas com o EXPLAIN QUERY PLAN.")
+            st.subheader("Páginas")
+            st.dataframe(pd.DataFrame(coletor.resumo("pagina")), hide_index=True, use_container_width=True)
+            st.subheader("Consultas")
+            st.dataframe(pd.DataFrame(coletor.resumo("consulta")), hide_index=True, use_container_width=True)
+            lentas = coletor.lentas()
+            st.subheader(f"Consultas Lentas ({len(lentas)})")
+            for ev in lentas:
+                with st.expander(f"{ev['ms']:.0f} ms · {ev['linhas']} linhas · {ev['em']} · {ev['chave'][:80]}"):
+                    st.code(ev['chave'], language="sql")
+                    st.code("\n".join(ev['plano']))
+
+        elif opt == "Cidades":
             with st.form("add_c"):
                 nm = st.text_input("Nome")
                 uf = st.selectbox("UF", ["SP","RJ","MG","PR","SC","RS","Outros"])
                 if st.form_submit_button("Salvar"):
                     run_action("INSERT INTO cidades (nome, estado) VALUES (?,?)", (nm, uf))
                     st.rerun()
-            st.dataframe(run_query("SELECT * FROM cidades ORDER BY nome"), hide_index=True)
+            st.dataframe(run_query(SQL_ADMIN_CIDADES), hide_index=True)
             
         elif opt == "Hospitais":
-            cs = run_query("SELECT id, nome, estado FROM cidades ORDER BY nome")
+            cs = run_query(SQL_ADMIN_CIDADES_OPCOES)
             with st.form("add_h"):
                 nm = st.text_input("Nome")
                 cid = st.selectbox("Cidade", cs['id'], format_func=lambda x: f"{cs[cs['id']==x]['nome'].values[0]}")
                 if st.form_submit_button("Salvar"):
                     run_action("INSERT INTO hospitais (nome, cidade_id) VALUES (?,?)", (nm, cid))
                     st.rerun()
-            st.dataframe(run_query("SELECT h.nome, c.nome as cid FROM hospitais h JOIN cidades c ON h.cidade_id=c.id"), hide_index=True)
+            st.dataframe(run_query(SQL_ADMIN_HOSPITAIS), hide_index=True)
             
         else:
             with st.form("add_g"):
@@ -484,4 +529,6 @@ else:
                 if st.form_submit_button("Salvar"):
                     run_action(f"INSERT INTO {opt.lower()} (nome) VALUES (?)", (nm,))
                     st.rerun()
-            st.dataframe(run_query(f"SELECT * FROM {opt.lower()} ORDER BY nome"), hide_index=True)
\ No newline at end of file
+            st.dataframe(run_query(SQL_LOOKUP_CADASTRO.format(tabela=opt.lower())), hide_index=True)
+
+    coletor.pagina(st.session_state['pagina_ativa'], inicio_pagina)
@@ -0,0 +1,132 @@
+"""Conexões SQLite compartilhadas pelo processo (todas as sessões do Streamlit).
+
+Leituras usam um pool de conexões; com WAL elas não bloqueiam nem são bloqueadas
+pela escrita. Escritas passam por uma única conexão protegida por trava, então
+dentro do processo nunca há dois escritores disputando o arquivo.
+"""
+import os
+import queue
+import re
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+# Padrão ao lado do código, não na pasta atual: o cli.py roda em cron a partir de qualquer diretório
+ARQUIVO_DB = os.environ.get("MYVAL_DB", os.path.join(os.path.dirname(os.path.abspath(__file__)), 'myval_dados.db'))
+TIMEOUT_OCUPADO_S = 5.0
+MAX_LEITORES_OCIOSOS = 8
+
+PRAGMAS = [
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",    # seguro com WAL; só o checkpoint faz fsync completo
+    "PRAGMA cache_size = -20000",     # ~20 MB de cache de páginas por conexão
+    "PRAGMA mmap_size = 268435456",   # leitura via mmap (256 MB)
+    "PRAGMA temp_store = MEMORY",
+]
+
+# Tabela alvo de um INSERT/UPDATE/DELETE (para invalidar caches que dependem dela)
+RE_TABELA_ALVO = re.compile(r"^\s*(?:INSERT(?:\s+OR\s+\w+)?\s+INTO|REPLACE\s+INTO|UPDATE(?:\s+OR\s+\w+)?|DELETE\s+FROM)\s+(\w+)", re.I)
+
+
+def tabela_alvo(sql):
+    m = RE_TABELA_ALVO.match(sql)
+    return m.group(1).lower() if m else None
+
+
+class GerenciadorConexoes:
+    def __init__(self, caminho):
+        self.caminho = caminho
+        self._ociosos = queue.LifoQueue()
+        self._trava_escrita = threading.Lock()
+        self._escritor = None
+        self._versoes = {}
+        self._externa = 0
+        self._trava_versoes = threading.Lock()
+
+    def versao(self, *tabelas):
+        """Contadores de escrita das tabelas: servem de chave para caches derivados delas.
+
+        O último item muda quando outro processo (cli.py, cron) grava no banco.
+        """
+        return tuple(self._versoes.get(t, 0) for t in tabelas) + (self.versao_externa(),)
+
+    def versao_externa(self):
+        # data_version da conexão de escrita só muda com commits de outras conexões: como toda
+        # escrita deste processo passa por ela, sobram as de fora. Durante uma escrita local
+        # vale o último valor lido (a conexão está ocupada).
+        if self._trava_escrita.acquire(blocking=False):
+            try:
+                if self._escritor is None:
+                    self._escritor = self.abrir()
+                self._externa = self._escritor.execute("PRAGMA data_version").fetchone()[0]
+            finally:
+                self._trava_escrita.release()
+        return self._externa
+
+    def invalidar(self, *tabelas):
+        with self._trava_versoes:
+            for t in filter(None, tabelas):
+                self._versoes[t] = self._versoes.get(t, 0) + 1
+
+    def abrir(self):
+        conn = sqlite3.connect(self.caminho, timeout=TIMEOUT_OCUPADO_S, check_same_thread=False)
+        for p in PRAGMAS:
+            conn.execute(p)
+        return conn
+
+    @contextmanager
+    def leitura(self):
+        try:
+            conn = self._ociosos.get_nowait()
+        except queue.Empty:
+            conn = self.abrir()
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            if self._ociosos.qsize() < MAX_LEITORES_OCIOSOS:
+                self._ociosos.put(conn)
+            else:
+                conn.close()
+
+    @contextmanager
+    def escrita(self, invalida=()):
+        """Conexão de escrita exclusiva: commit ao sair do bloco, rollback em caso de erro.
+
+        As tabelas em `invalida` têm a versão incrementada depois do commit.
+        """
+        with self._trava_escrita:
+            if self._escritor is None:
+                self._escritor = self.abrir()
+            conn = self._escritor
+            try:
+                yield conn
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+        self.invalidar(*invalida)
+
+    def fechar(self):
+        with self._trava_escrita:
+            if self._escritor is not None:
+                self._escritor.close()
+                self._escritor = None
+        while True:
+            try:
+                self._ociosos.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+_gerenciadores = {}
+_trava_gerenciadores = threading.Lock()
+
+
+def gerenciador(caminho):
+    """Um gerenciador por arquivo de banco, compartilhado por todo o processo."""
+    with _trava_gerenciadores:
+        if caminho not in _gerenciadores:
+            _gerenciadores[caminho] = GerenciadorConexoes(caminho)
+        return _gerenciadores[caminho]
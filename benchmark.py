@@ -0,0 +1,198 @@
+"""Benchmark reproduzível dos caminhos críticos do app, com dados sintéticos.
+
+Uso: python benchmark.py [--linhas 10000 100000 1000000] [--saida resultado.json] [--semente 42]
+
+Para cada tamanho gera um CSV no layout de dados.csv, faz a carga inicial num
+SQLite novo (o mesmo caminho de inicializar_e_migrar) e cronometra as consultas
+do Dashboard, da Consulta, dos cadastros e a geração de PDF. O resultado é um
+JSON, para comparar execuções antes e depois de uma mudança.
+"""
+import argparse
+import csv
+import itertools
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+import pandas as pd
+
+from banco import GerenciadorConexoes
+from consultas import (CADASTROS, SQL_DASHBOARD_GENERO, SQL_DASHBOARD_KPIS, SQL_DASHBOARD_TOP_HOSPITAIS,
+                       SQL_LOOKUP_CADASTRO, SQL_LOOKUP_HOSPITAIS, SQL_OPCOES_ESPECIALISTAS, SQL_OPCOES_HOSPITAIS,
+                       chave_pagina, sql_consulta)
+from importador import importar_csv
+from migracoes import migrar
+from rastreabilidade import procedimentos_por_lotes
+from relatorios import gerar_pdf
+
+TAMANHOS_PADRAO = [10_000, 100_000, 1_000_000]
+REPETICOES = 20
+
+# Cabeçalho exatamente como vem na exportação (espaços e sufixos inclusos)
+CABECALHO = ['Data ', 'Patient ', 'Age ', 'Gender', 'Hospital ', 'City ', 'State ', 'Specialist / Crimper ', 'Report',
+             'Proctor ', 'Proctor Form', 'Overnight stay', 'Proctor - ECO', '1st operator', '2st operator ', 'Team Status',
+             'Distributor/Meril ', 'Anatomical details', ' Offlabel form ', 'Access', ' Offlabel form .1', 'Myval Size',
+             'SN', 'Navigator ', 'Lot', 'Mammoth ', 'Lot.1', 'Val de Crimp - Lot', 'Phyton - Lot', 'Guidewire', 'Comments',
+             'Unnamed: 31']
+
+UFS = ["SP", "RJ", "MG", "PR", "SC", "RS", "BA", "PE", "CE", "GO", "DF", "ES", "PA", "MT", "MS"]
+TAMANHOS_VALVULA = ["20mm", "21,5mm", "23mm", "24,5mm", "26mm", "27,5mm", "29mm", "30,5mm", "32mm"]
+ANATOMIAS = ["Aortic Native", "Aortic Native- Bicuspide Type 1", "Tricuspide Native", "Aortic VIV", "Mitral VIV",
+             "Native Aortic/ Tricuspide Av"]
+ACESSOS = ["Femoral"] * 40 + ["Subclavian", "Transcarotid", "Trans-aortic"]
+GUIDEWIRES = ["Lunderquist", "Safari", "Safari Extra Small", "Confida", "Angelguide", "Amplatz"]
+COMENTARIOS = ["Implante sem intercorrências.", "Pós dilatação com +1ml.", "Implante + 2ml", "Pré dilatação com balão 20mm.",
+               "Leak paravalvar discreto.", "Paciente estável, alta no dia seguinte.", "Calcificação importante do anel.", ""]
+SILABAS = ["ma", "ri", "jo", "se", "an", "to", "lu", "ca", "pe", "dro", "ra", "fa", "el", "bru", "na", "li", "vi", "ta"]
+
+
+def nome_sintetico(rng, partes=2):
+    return " ".join("".join(rng.choice(SILABAS) for _ in range(rng.randint(2, 3))).title() for _ in range(partes))
+
+
+def gerar_csv(caminho, linhas, semente=42):
+    """CSV com `linhas` procedimentos no formato de dados.csv; mesma semente, mesmo arquivo."""
+    rng = random.Random(semente)
+    # Cadastros crescem com o volume, mas com teto (como numa rede real de hospitais)
+    cidades = [(nome_sintetico(rng, 1), rng.choice(UFS)) for _ in range(min(1500, 20 + linhas // 10))]
+    hospitais = [(f"Hospital {nome_sintetico(rng, 1)} {i}", *rng.choice(cidades)) for i in range(min(5000, 50 + linhas // 3))]
+    especialistas = [nome_sintetico(rng) for _ in range(min(2000, 20 + linhas // 10))]
+    operadores = [nome_sintetico(rng) for _ in range(min(20000, 50 + linhas // 2))]
+    proctors = ["No"] * 10 + [nome_sintetico(rng) for _ in range(60)]
+    distribuidores = ["Meril"] + [nome_sintetico(rng, 1) for _ in range(min(200, 5 + linhas // 1000))]
+    relatores = ["No Report", "Corelab"] + [nome_sintetico(rng) for _ in range(20)]
+    lote = lambda prefixo: f"{prefixo}{rng.choice('ABCDEFGH')}{rng.choice('ABCDEFGH')}{rng.randint(10, 99)}"
+    inicio, dias = date(2019, 1, 1), (date(2025, 12, 31) - date(2019, 1, 1)).days
+
+    with open(caminho, "w", newline="", encoding="utf-8") as f:
+        w = csv.writer(f)
+        w.writerow(CABECALHO)
+        for i in range(linhas):
+            hosp, cid, uf = rng.choice(hospitais)
+            tam = rng.choice(TAMANHOS_VALVULA)
+            w.writerow([
+                (inicio + timedelta(days=rng.randint(0, dias))).isoformat(), "".join(rng.choices("ABCDEFGHIJLMNOPRSTV", k=rng.randint(2, 4))),
+                f"{rng.randint(55, 95)}.0", rng.choice(["Male", "Female", "Male ", "male"]), hosp, cid, uf,
+                rng.choice(especialistas), rng.choice(relatores), rng.choice(proctors), rng.choice(["Yes", "No"]),
+                rng.choice(["No"] * 8 + ["Yes-1", "Yes"]), "No", rng.choice(operadores), rng.choice(operadores),
+                rng.choice(["Certified", "Not Certified"]), rng.choice(distribuidores), rng.choice(ANATOMIAS),
+                rng.choice(["Not Necessary", "Yes"]), rng.choice(ACESSOS), "Not necessary", tam,
+                f"MV{rng.choice('AB')}{i:08d}", tam, lote("PMTD"), rng.choice(["Not Used", "20mm", "18mm", "23mm"]), lote("PMTV"),
+                lote("PVLDC"), lote("PPHT"), rng.choice(GUIDEWIRES), rng.choice(COMENTARIOS), "",
+            ])
+
+
+def cronometrar(fn, repeticoes=REPETICOES):
+    """Estatísticas em ms de `repeticoes` execuções de fn() (a primeira, fria, é descartada)."""
+    fn()
+    tempos = []
+    for _ in range(repeticoes):
+        t = time.perf_counter()
+        fn()
+        tempos.append((time.perf_counter() - t) * 1000)
+    tempos.sort()
+    return {"n": repeticoes, "min_ms": round(tempos[0], 3), "p50_ms": round(statistics.median(tempos), 3),
+            "p95_ms": round(tempos[max(0, int(0.95 * repeticoes) - 1)], 3), "max_ms": round(tempos[-1], 3)}
+
+
+def medir_uma_vez(fn):
+    t = time.perf_counter()
+    ret = fn()
+    return {"n": 1, "ms": round((time.perf_counter() - t) * 1000, 3)}, ret
+
+
+def benchmark(linhas, pasta, semente=42):
+    csv_path, db_path = os.path.join(pasta, f"bench_{linhas}.csv"), os.path.join(pasta, f"bench_{linhas}.db")
+    etapas = {}
+    etapas["gerar_csv"], _ = medir_uma_vez(lambda: gerar_csv(csv_path, linhas, semente))
+
+    # Carga inicial: migrações + importação em lote numa transação (como inicializar_e_migrar)
+    db = GerenciadorConexoes(db_path)
+    def carga():
+        with db.escrita() as conn:
+            migrar(conn)
+            return importar_csv(conn, csv_path)
+    etapas["importacao_inicial"], res = medir_uma_vez(carga)
+    etapas["importacao_inicial"]["importados"] = res.importados
+    def reimportar():
+        with db.escrita() as conn:
+            return importar_csv(conn, csv_path, incremental=True)
+    etapas["reimportacao_inalterada"], _ = medir_uma_vez(reimportar)
+
+    with db.leitura() as conn:
+        q = lambda sql, params=(): pd.read_sql(sql, conn, params=params)
+        tudo, ano = ("2019-01-01", "2025-12-31"), ("2025-01-01", "2025-12-31")
+
+        for nome, periodo in (("tudo", tudo), ("ano", ano)):
+            etapas[f"dashboard_{nome}"] = cronometrar(lambda: [q(sql, periodo) for sql in
+                                                              (SQL_DASHBOARD_KPIS, SQL_DASHBOARD_TOP_HOSPITAIS, SQL_DASHBOARD_GENERO)])
+
+        etapas["referencias"] = cronometrar(lambda: [q(SQL_LOOKUP_HOSPITAIS)] + [q(SQL_LOOKUP_CADASTRO.format(tabela=t)) for t in CADASTROS])
+        etapas["opcoes_consulta"] = cronometrar(lambda: (q(SQL_OPCOES_HOSPITAIS), q(SQL_OPCOES_ESPECIALISTAS)))
+
+        consulta = lambda *a, **k: q(*sql_consulta(*a, **k))
+        meio = q(*sql_consulta(limite=linhas // 2)).iloc[-1]
+        hospital = q(SQL_DASHBOARD_TOP_HOSPITAIS, tudo)['hospital'].iloc[0]
+        etapas["consulta_primeira_pagina"] = cronometrar(lambda: consulta())
+        etapas["consulta_pagina_do_meio"] = cronometrar(lambda: consulta(apos=chave_pagina(meio)))
+        etapas["consulta_filtro_hospital"] = cronometrar(lambda: consulta("", [hospital]))
+        etapas["consulta_busca_comum"] = cronometrar(lambda: consulta("implante"))
+        etapas["consulta_busca_rara"] = cronometrar(lambda: consulta("leak paravalvar"))
+
+        amostra = q(*sql_consulta(limite=50))
+        lotes = amostra['sn_protese'].tolist()
+        etapas["rastreabilidade_50_lotes"] = cronometrar(lambda: procedimentos_por_lotes(conn, lotes))
+
+        registros = itertools.cycle(amostra.to_dict("records"))
+        etapas["gerar_pdf"] = cronometrar(lambda: gerar_pdf(next(registros)), repeticoes=len(amostra))
+
+    db.fechar()
+    return {"linhas": linhas, "banco_mb": round(os.path.getsize(db_path) / 2**20, 1), "etapas": etapas}
+
+
+def metadados(semente):
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {"quando": datetime.now().isoformat(timespec="seconds"), "commit": commit, "semente": semente,
+            "python": platform.python_version(), "sqlite": sqlite3.sqlite_version, "pandas": pd.__version__,
+            "plataforma": platform.platform(), "cpus": os.cpu_count()}
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--linhas", type=int, nargs="+", default=TAMANHOS_PADRAO, help="tamanhos a medir (padrão: 10k, 100k e 1M)")
+    ap.add_argument("--saida", help="grava o JSON neste arquivo (além de imprimir)")
+    ap.add_argument("--semente", type=int, default=42)
+    ap.add_argument("--pasta", help="onde gerar CSV e banco (padrão: temporária, apagada no fim)")
+    args = ap.parse_args()
+
+    pasta = args.pasta or tempfile.mkdtemp(prefix="myval_bench_")
+    os.makedirs(pasta, exist_ok=True)
+    try:
+        saida = {"meta": metadados(args.semente), "resultados": []}
+        for n in args.linhas:
+            saida["resultados"].append(benchmark(n, pasta, args.semente))
+            print(f"{n} linhas: ok", flush=True)
+    finally:
+        if not args.pasta:
+            shutil.rmtree(pasta, ignore_errors=True)
+
+    texto = json.dumps(saida, indent=2, ensure_ascii=False)
+    if args.saida:
+        with open(args.saida, "w", encoding="utf-8") as f:
+            f.write(texto)
+    print(texto)
+
+
+if __name__ == "__main__":
+    main()
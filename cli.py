@@ -0,0 +1,159 @@
+"""Jobs em lote sem o Streamlit: importação, exportação, relatórios e manutenção do banco.
+
+Uso:
+  python cli.py importar ARQUIVO.csv|.xlsx
+  python cli.py exportar [--saida base.csv] [--busca TEXTO] [--hospital NOME ...] [--especialista NOME ...]
+  python cli.py relatorios [--formato zip|pdf] [--saida ARQUIVO] [--processos N] [mesmos filtros]
+  python cli.py deduplicar TABELA [--limiar 0.8] [--aplicar]
+  python cli.py inicializar | analyze | vacuum
+
+Todos aceitam --db ARQUIVO (padrão: variável MYVAL_DB ou myval_dados.db ao lado do código);
+só o inicializar aceita um banco que ainda não existe. Os módulos
+do projeto são importados só pelo comando que os usa: analyze e vacuum nem carregam o pandas.
+"""
+import argparse
+import csv
+import os
+import sys
+import time
+
+
+def aviso(msg):
+    print(msg, file=sys.stderr, flush=True)
+
+
+def filtros(args):
+    return args.busca, args.hospital, args.especialista
+
+
+def cmd_inicializar(args):
+    from repositorio import ARQUIVO_CSV, ARQUIVO_XLSX, inicializar_banco
+
+    res = inicializar_banco()
+    if res and res.sem_origem:
+        aviso(f"{res.resumo()} (procurado: {ARQUIVO_CSV}, {ARQUIVO_XLSX})")
+        sys.exit(1)
+    aviso(res.resumo() if res else "Migrações aplicadas; banco já tinha dados")
+
+
+def cmd_importar(args):
+    from repositorio import importar
+
+    res = importar(args.arquivo)
+    for l, m in res.rejeitados:
+        aviso(f"linha {l}: {m}")
+    aviso(res.resumo())
+
+
+def cmd_exportar(args):
+    from consultas import sql_consulta
+    from repositorio import iter_query
+
+    sql, params = sql_consulta(*filtros(args), limite=None)
+    saida = open(args.saida, "w", newline="", encoding="utf-8") if args.saida else sys.stdout
+    n, w = 0, None
+    try:
+        for reg in iter_query(sql, params):
+            if w is None:
+                w = csv.DictWriter(saida, fieldnames=list(reg))
+                w.writeheader()
+            w.writerow(reg)
+            n += 1
+    finally:
+        if saida is not sys.stdout:
+            saida.close()
+    aviso(f"{n} procedimentos exportados")
+
+
+def cmd_relatorios(args):
+    from consultas import sql_consulta
+    from relatorios import exportar_pdf_unico, exportar_zip
+    from repositorio import iter_query
+
+    sql, params = sql_consulta(*filtros(args), limite=None)
+    saida = args.saida or f"Relatorios.{args.formato}"
+    progresso = lambda n: n % 100 == 0 and aviso(f"{n} relatórios...")
+    if args.formato == "zip":
+        erros = exportar_zip(iter_query(sql, params), saida, processos=args.processos, progresso=progresso)
+        for rid, erro in erros.items():
+            aviso(f"procedimento {rid}: {erro}")
+    else:
+        exportar_pdf_unico(iter_query(sql, params), saida, progresso=progresso)
+    aviso(f"Gravado em {saida}")
+
+
+def cmd_deduplicar(args):
+    from repositorio import mesclar_duplicados, sugerir_duplicados
+
+    grupos = sugerir_duplicados(args.tabela, args.limiar)
+    for g in grupos:
+        print(f"[{g.similaridade:.2f}] " + (f"({g.local}) " if g.local else "") + " | ".join(f"{g.nomes[i]!r} ({g.usos[i]})" for i in [g.manter] + g.remover))
+    if args.aplicar and grupos:
+        aviso(f"{mesclar_duplicados(args.tabela, grupos)} cadastros mesclados")
+    else:
+        aviso(f"{len(grupos)} grupos sugeridos" + (" (use --aplicar para mesclar)" if grupos else ""))
+
+
+def cmd_analyze(args):
+    from banco import ARQUIVO_DB, gerenciador
+
+    with gerenciador(ARQUIVO_DB).escrita() as conn:
+        conn.execute("ANALYZE")
+        conn.execute("PRAGMA optimize")
+    aviso("Estatísticas do planejador atualizadas")
+
+
+def cmd_vacuum(args):
+    from banco import ARQUIVO_DB, gerenciador
+
+    antes = os.path.getsize(ARQUIVO_DB)
+    with gerenciador(ARQUIVO_DB).escrita() as conn:
+        conn.execute("VACUUM")  # fora de transação: o sqlite3 não abre uma antes de VACUUM
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    aviso(f"{antes / 2**20:.1f} MB -> {os.path.getsize(ARQUIVO_DB) / 2**20:.1f} MB")
+
+
+def main(argv=None):
+    from deduplicacao import ENTIDADES, LIMIAR  # só biblioteca padrão
+
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--db", help="arquivo SQLite (padrão: MYVAL_DB ou myval_dados.db)")
+    sub = ap.add_subparsers(dest="comando", required=True)
+
+    sub.add_parser("inicializar", help="aplica as migrações; com o banco vazio, faz a carga inicial").set_defaults(func=cmd_inicializar)
+    p = sub.add_parser("importar", help="importação incremental de um CSV ou XLSX")
+    p.add_argument("arquivo")
+    p.set_defaults(func=cmd_importar)
+    for nome, func, ajuda in (("exportar", cmd_exportar, "procedimentos do filtro em CSV (stdout se sem --saida)"),
+                              ("relatorios", cmd_relatorios, "PDFs do filtro, em ZIP ou num PDF único")):
+        p = sub.add_parser(nome, help=ajuda)
+        p.add_argument("--busca", default="", help="texto da busca (mesma sintaxe da Consulta)")
+        p.add_argument("--hospital", nargs="+", default=[])
+        p.add_argument("--especialista", nargs="+", default=[])
+        p.add_argument("--saida")
+        p.set_defaults(func=func)
+    p.add_argument("--formato", choices=["zip", "pdf"], default="zip")
+    p.add_argument("--processos", type=int, help="processos para renderizar (padrão: núcleos da máquina)")
+    p = sub.add_parser("deduplicar", help="sugere (e com --aplicar mescla) cadastros duplicados")
+    p.add_argument("tabela", choices=list(ENTIDADES))
+    p.add_argument("--limiar", type=float, default=LIMIAR, help=f"similaridade mínima entre nomes (0 a 1, padrão {LIMIAR})")
+    p.add_argument("--aplicar", action="store_true", help="mescla todos os grupos sugeridos, mantendo o cadastro mais usado")
+    p.set_defaults(func=cmd_deduplicar)
+    sub.add_parser("analyze", help="ANALYZE + PRAGMA optimize").set_defaults(func=cmd_analyze)
+    sub.add_parser("vacuum", help="VACUUM e checkpoint do WAL").set_defaults(func=cmd_vacuum)
+
+    args = ap.parse_args(argv)
+    if args.db:
+        os.environ["MYVAL_DB"] = args.db  # antes de importar banco/repositorio, que leem o padrão daí
+    from banco import ARQUIVO_DB
+
+    # Só o inicializar cria o banco: nos demais, um caminho errado não pode virar um banco vazio novo
+    if args.comando != "inicializar" and not os.path.exists(ARQUIVO_DB):
+        ap.error(f"banco {ARQUIVO_DB} não encontrado (crie com: cli.py inicializar)")
+    inicio = time.perf_counter()
+    args.func(args)
+    aviso(f"({args.comando}: {time.perf_counter() - inicio:.2f} s)")
+
+
+if __name__ == "__main__":
+    main()
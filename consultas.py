@@ -0,0 +1,204 @@
+"""Consultas SQL de leitura usadas pelo app e diagnóstico de plano de execução.
+
+Uso: python consultas.py [arquivo.db]  -> imprime o EXPLAIN QUERY PLAN de cada consulta.
+"""
+import re
+import sqlite3
+import sys
+
+CADASTROS = ["distribuidores", "especialistas", "proctors", "operadores"]
+# Tabelas de referência do formulário "Novo" (o cache delas é invalidado quando alguma muda)
+TABELAS_REFERENCIA = ["cidades", "hospitais"] + CADASTROS
+
+SQL_REGISTRO = "SELECT * FROM procedimentos WHERE id = ?"
+
+# Dashboard: agregações feitas no SQLite, só poucas linhas voltam para o app
+SQL_DASHBOARD_KPIS = """
+    SELECT COUNT(*) as procedimentos,
+           COUNT(DISTINCT h.nome) as hospitais,
+           COALESCE(SUM(p.team_status = 'Certified'), 0) as certificados,
+           COALESCE(SUM(d.nome LIKE '%Meril%'), 0) as meril
+    FROM procedimentos p
+    LEFT JOIN hospitais h ON p.hospital_id = h.id
+    LEFT JOIN distribuidores d ON p.distribuidor_id = d.id
+    WHERE p.data_proc BETWEEN ? AND ?
+"""
+
+SQL_DASHBOARD_TOP_HOSPITAIS = """
+    SELECT h.nome as hospital, COUNT(*) as n
+    FROM procedimentos p
+    JOIN hospitais h ON p.hospital_id = h.id
+    WHERE p.data_proc BETWEEN ? AND ?
+    GROUP BY h.nome
+    ORDER BY n DESC, h.nome
+    LIMIT 8
+"""
+
+SQL_DASHBOARD_GENERO = """
+    SELECT p.genero, COUNT(*) as n
+    FROM procedimentos p
+    WHERE p.data_proc BETWEEN ? AND ? AND p.genero IS NOT NULL
+    GROUP BY p.genero
+    ORDER BY n DESC
+"""
+
+SQL_LOOKUP_HOSPITAIS = "SELECT h.id, h.nome, c.nome||'/'||c.estado as loc FROM hospitais h JOIN cidades c ON h.cidade_id=c.id ORDER BY h.nome"
+SQL_LOOKUP_CADASTRO = "SELECT * FROM {tabela} ORDER BY nome"
+
+# Consulta: filtros viram WHERE parametrizado e a paginação é por chave (data_proc, id)
+POR_PAGINA = 50
+
+SQL_CONSULTA_CAMPOS = """
+    SELECT p.id, p.data_proc, p.paciente, h.nome as Hospital, c.nome as Cidade, c.estado as UF,
+           s.nome as Especialista, pr.nome as Proctor, p.team_status, p.myval_size, p.sn_protese, p.anatomical_details, p.comentarios
+"""
+SQL_CONSULTA_JOINS = """
+    LEFT JOIN hospitais h ON p.hospital_id = h.id
+    LEFT JOIN cidades c ON h.cidade_id = c.id
+    LEFT JOIN especialistas s ON p.specialist_id = s.id
+    LEFT JOIN proctors pr ON p.proctor_id = pr.id
+"""
+SQL_CONSULTA = SQL_CONSULTA_CAMPOS + "FROM procedimentos p" + SQL_CONSULTA_JOINS
+
+SQL_OPCOES_HOSPITAIS = """
+    SELECT DISTINCT h.nome FROM hospitais h
+    WHERE EXISTS (SELECT 1 FROM procedimentos p WHERE p.hospital_id = h.id)
+    ORDER BY h.nome
+"""
+SQL_OPCOES_ESPECIALISTAS = """
+    SELECT s.nome FROM especialistas s
+    WHERE EXISTS (SELECT 1 FROM procedimentos p WHERE p.specialist_id = s.id)
+    ORDER BY s.nome
+"""
+
+
+def marcadores(valores):
+    return ', '.join('?' * len(valores))
+
+
+def termo_fts(texto):
+    # Cada palavra vira um prefixo entre aspas ("pos"* "dilata"*): todas precisam aparecer,
+    # e aspas, AND/OR/NEAR digitados pelo usuário não viram sintaxe do FTS5
+    return ' '.join(f'"{p}"*' for p in re.findall(r'\w+', texto or ''))
+
+
+def sql_consulta(busca="", hospitais=(), especialistas=(), apos=None, limite=POR_PAGINA):
+    """Uma página da Consulta.
+
+    Sem busca, da data mais recente para a mais antiga, e `apos` é a chave
+    (data_proc, id) da última linha da página anterior. Com busca (FTS5), por
+    relevância, e `apos` é (relevancia, id). limite=None devolve todas as linhas.
+    """
+    termo = termo_fts(busca)
+    cond, params = [], []
+    if termo:
+        base = f"{SQL_CONSULTA_CAMPOS}, f.rank as relevancia FROM procedimentos_fts f JOIN procedimentos p ON p.id = f.rowid {SQL_CONSULTA_JOINS}"
+        cond.append("procedimentos_fts MATCH ?")
+        params.append(termo)
+    else:
+        base = SQL_CONSULTA
+    if hospitais:
+        cond.append(f"h.nome IN ({marcadores(hospitais)})")
+        params += list(hospitais)
+    if especialistas:
+        cond.append(f"s.nome IN ({marcadores(especialistas)})")
+        params += list(especialistas)
+    if apos is not None and termo:
+        cond.append("(f.rank > ? OR (f.rank = ? AND p.id > ?))")
+        params += [apos[0], apos[0], apos[1]]
+    elif apos is not None:
+        # Forma expandida de (data_proc, id) < (?, ?): o "data_proc <= ?" permite buscar direto no índice
+        cond.append("p.data_proc <= ? AND (p.data_proc < ? OR p.id < ?)")
+        params += [apos[0], apos[0], apos[1]]
+    where = f"WHERE {' AND '.join(cond)}" if cond else ""
+    ordem = "f.rank, p.id" if termo else "p.data_proc DESC, p.id DESC"
+    paginacao = f" LIMIT {int(limite)}" if limite else ""
+    return f"{base} {where} ORDER BY {ordem}{paginacao}", params
+
+
+def sql_contagem(busca="", hospitais=(), especialistas=()):
+    """Quantos procedimentos o filtro da Consulta devolve, somando todas as páginas (coluna n)."""
+    sql, params = sql_consulta(busca, hospitais, especialistas, limite=None)
+    return f"SELECT count(*) AS n FROM ({sql})", params
+
+
+def chave_pagina(linha):
+    """Chave da linha para pedir a página seguinte em sql_consulta(apos=...)."""
+    if 'relevancia' in linha:
+        return (float(linha['relevancia']), int(linha['id']))
+    return (linha['data_proc'], int(linha['id']))
+
+
+# Rastreabilidade: lotes normalizados chegam como um array JSON (um parâmetro só, qualquer quantidade)
+SQL_RASTREABILIDADE = """
+    SELECT v.* FROM json_each(?) j
+    JOIN v_rastreabilidade v ON v.lote = j.value
+    ORDER BY v.lote, v.data_proc
+"""
+
+
+SQL_ADMIN_IMPORTACOES = "SELECT arquivo, linhas, importado_em FROM importacoes ORDER BY importado_em DESC"
+SQL_ADMIN_CIDADES = "SELECT * FROM cidades ORDER BY nome"
+SQL_ADMIN_CIDADES_OPCOES = "SELECT id, nome, estado FROM cidades ORDER BY nome"
+SQL_ADMIN_HOSPITAIS = "SELECT h.nome, c.nome as cid FROM hospitais h JOIN cidades c ON h.cidade_id=c.id"
+
+
+def consultas_do_app():
+    """Todas as consultas de leitura que o app emite, por nome."""
+    lista = {
+        "registro": SQL_REGISTRO,
+        "dashboard_kpis": SQL_DASHBOARD_KPIS,
+        "dashboard_top_hospitais": SQL_DASHBOARD_TOP_HOSPITAIS,
+        "dashboard_genero": SQL_DASHBOARD_GENERO,
+        "lookup_hospitais": SQL_LOOKUP_HOSPITAIS,
+        "consulta": sql_consulta()[0],
+        "consulta_pagina": sql_consulta(apos=("", 0))[0],
+        "consulta_filtros": sql_consulta("", ["h"], ["s"], apos=("", 0))[0],
+        "consulta_busca": sql_consulta("x", apos=(0.0, 0))[0],
+        "consulta_contagem": sql_contagem("", ["h"], ["s"])[0],
+        "consulta_opcoes_hospitais": SQL_OPCOES_HOSPITAIS,
+        "consulta_opcoes_especialistas": SQL_OPCOES_ESPECIALISTAS,
+        "rastreabilidade": SQL_RASTREABILIDADE,
+        "admin_importacoes": SQL_ADMIN_IMPORTACOES,
+        "admin_cidades": SQL_ADMIN_CIDADES,
+        "admin_cidades_opcoes": SQL_ADMIN_CIDADES_OPCOES,
+        "admin_hospitais": SQL_ADMIN_HOSPITAIS,
+    }
+    for t in CADASTROS:
+        lista[f"lookup_{t}"] = SQL_LOOKUP_CADASTRO.format(tabela=t)
+    return lista
+
+
+def plano(conn, sql):
+    # Os valores dos parâmetros não mudam o plano: basta preencher os marcadores
+    linhas = conn.execute("EXPLAIN QUERY PLAN " + sql, (None,) * sql.count('?')).fetchall()
+    nivel = {0: -1}
+    saida = []
+    for id_, pai, _, detalhe in linhas:
+        nivel[id_] = nivel.get(pai, -1) + 1
+        saida.append("  " * nivel[id_] + detalhe)
+    return saida
+
+
+def explicar_consultas(conn):
+    return {nome: plano(conn, sql) for nome, sql in consultas_do_app().items()}
+
+
+if __name__ == "__main__":
+    from pathlib import Path
+
+    from banco import ARQUIVO_DB
+    from migracoes import VERSAO_ATUAL, versao
+
+    caminho = Path(sys.argv[1] if len(sys.argv) > 1 else ARQUIVO_DB)
+    if not caminho.is_file():
+        sys.exit(f"banco {caminho} não encontrado")
+    # Diagnóstico só lê: não cria banco nem aplica migrações (isso é com cli.py inicializar, sob a trava de escrita)
+    conn = sqlite3.connect(f"{caminho.absolute().as_uri()}?mode=ro", uri=True)
+    if versao(conn) < VERSAO_ATUAL:
+        sys.exit(f"banco {caminho} na versão {versao(conn)} do esquema, esperada {VERSAO_ATUAL}: rode cli.py inicializar antes")
+    for nome, linhas in explicar_consultas(conn).items():
+        print(f"== {nome} ==")
+        print("\n".join(linhas))
+        print()
+    conn.close()
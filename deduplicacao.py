@@ -0,0 +1,183 @@
+"""Resolução de cadastros duplicados (hospitais, cidades, especialistas, operadores...).
+
+Nomes são comparados por trigramas do texto normalizado (sem acentos, caixa, pontuação
+nem espaços extras), com similaridade de Jaccard. Para não comparar todos os pares, cada
+nome só é indexado por pares dos seus trigramas mais raros (filtro de prefixo, ver
+chaves_bloco) e só é comparado com quem divide uma dessas chaves. Nenhum par acima do
+limiar é perdido. Homônimos de partições diferentes (hospitais de cidades diferentes,
+cidades de UFs diferentes) nunca são comparados.
+
+Uso pela linha de comando: python cli.py deduplicar TABELA [--limiar 0.8] [--aplicar]
+"""
+import math
+import re
+import unicodedata
+from collections import Counter, defaultdict
+from dataclasses import dataclass, field
+from itertools import combinations, islice
+
+LIMIAR = 0.8
+
+# tabela -> (coluna que separa homônimos legítimos, [(tabela, chave estrangeira) que apontam para ela])
+ENTIDADES = {
+    "cidades": ("estado", [("hospitais", "cidade_id")]),
+    "hospitais": ("cidade_id", [("procedimentos", "hospital_id")]),  # "Unimed" de Joinville != "Unimed" de Belém
+    "distribuidores": (None, [("procedimentos", "distribuidor_id")]),
+    "especialistas": (None, [("procedimentos", "specialist_id")]),
+    "proctors": (None, [("procedimentos", "proctor_id")]),
+    "operadores": (None, [("procedimentos", "op1_id"), ("procedimentos", "op2_id")]),
+}
+# Como mostrar a partição ao usuário
+LOCAL = {"cidades": "estado", "hospitais": "(SELECT nome || ' - ' || estado FROM cidades WHERE id = t.cidade_id)"}
+
+
+@dataclass
+class Grupo:
+    manter: int                                   # id canônico (o mais usado)
+    remover: list                                 # ids que passam a apontar para o canônico
+    nomes: dict = field(default_factory=dict)     # id -> nome
+    usos: dict = field(default_factory=dict)      # id -> referências em outras tabelas
+    similaridade: float = 1.0                     # menor similaridade entre pares ligados no grupo
+    local: str = None                             # UF da cidade / cidade do hospital
+
+
+def normalizar_nome(nome):
+    sem_acento = unicodedata.normalize("NFKD", str(nome or "")).encode("ascii", "ignore").decode()
+    return " ".join(re.findall(r"[a-z0-9]+", sem_acento.lower()))
+
+
+def trigramas(nome):
+    texto = f" {normalizar_nome(nome)} "
+    return {texto[i:i + 3] for i in range(len(texto) - 2)}
+
+
+def chaves_bloco(ordem, limiar):
+    """Chaves de bloco de um nome: pares de trigramas do início de `ordem` (seus trigramas, do mais raro ao mais comum).
+
+    Jaccard >= limiar exige ao menos ceil(limiar * |A|) trigramas em comum; então os prefixos de
+    tamanho |A| - ceil(limiar * |A|) + 2 dos dois nomes têm pelo menos dois trigramas em comum, e
+    indexar os pares do prefixo não perde nenhum par. Pares são bem mais seletivos que trigramas
+    soltos: "sil" e "ana" aparecem em milhares de nomes, os dois juntos em poucos.
+    """
+    return list(combinations(ordem[:len(ordem) - math.ceil(limiar * len(ordem)) + 2], 2))
+
+
+def pares_similares(nomes, limiar=LIMIAR):
+    """{id: nome} -> [(id_a, id_b, similaridade)] com similaridade >= limiar, sem comparar todos os pares.
+
+    Nomes sem nenhuma letra ou dígito ("-", "?", vazio) não têm trigramas e ficam de fora.
+    """
+    grams = {i: gs for i, gs in ((i, trigramas(n)) for i, n in nomes.items()) if gs}
+    freq = Counter(g for gs in grams.values() for g in gs)
+    indice, inicio = defaultdict(list), defaultdict(int)
+    pares = []
+    # Dos menores para os maiores: cada lista do índice fica ordenada por tamanho, e quem ficou curto
+    # demais para o nome atual (|B| < limiar * |A|) fica curto para todos os seguintes: o início só avança
+    for i in sorted(grams, key=lambda i: len(grams[i])):
+        gs = grams[i]
+        minimo = limiar * len(gs)
+        candidatos = set()
+        # O texto normalizado também é chave: pega nomes curtos demais para ter dois trigramas em comum
+        for chave in chaves_bloco(sorted(gs, key=lambda g: (freq[g], g)), limiar) + [normalizar_nome(nomes[i])]:
+            lista = indice[chave]
+            while inicio[chave] < len(lista) and len(grams[lista[inicio[chave]]]) < minimo:
+                inicio[chave] += 1
+            candidatos.update(islice(lista, inicio[chave], None))
+            lista.append(i)
+        for j in candidatos:
+            # Jaccard: interseção / união, com a união por contagem
+            comum = len(gs & grams[j])
+            s = comum / (len(gs) + len(grams[j]) - comum)
+            if s >= limiar:
+                pares.append((j, i, s))
+    return pares
+
+
+def agrupar(pares):
+    """Componentes conexos (union-find) dos pares: [(ids, menor similaridade)]."""
+    pai = {}
+
+    def raiz(x):
+        pai.setdefault(x, x)
+        while pai[x] != x:
+            pai[x] = pai[pai[x]]
+            x = pai[x]
+        return x
+
+    for a, b, _ in pares:
+        pai[raiz(a)] = raiz(b)
+    grupos, menor = defaultdict(set), {}
+    for a, b, s in pares:
+        r = raiz(a)
+        grupos[r] |= {a, b}
+        menor[r] = min(menor.get(r, 1.0), s)
+    return [(ids, menor[r]) for r, ids in grupos.items()]
+
+
+def usos(conn, tabela):
+    contagem = Counter()
+    for tab, fk in ENTIDADES[tabela][1]:
+        contagem.update(dict(conn.execute(f"SELECT {fk}, count(*) FROM {tab} WHERE {fk} IS NOT NULL GROUP BY {fk}")))
+    return contagem
+
+
+def sugerir(conn, tabela, limiar=LIMIAR):
+    """Grupos de prováveis duplicados de `tabela`, dos maiores para os menores."""
+    particao, _ = ENTIDADES[tabela]
+    por_particao = defaultdict(dict)
+    locais = {}
+    for i, nome, p, l in conn.execute(f"SELECT id, nome, {particao or 'NULL'}, {LOCAL.get(tabela, 'NULL')} FROM {tabela} t"):
+        por_particao[p][i] = nome
+        locais[p] = l
+    contagem = usos(conn, tabela)
+    grupos = []
+    for p, nomes in por_particao.items():
+        for ids, similaridade in agrupar(pares_similares(nomes, limiar)):
+            # Canônico: o mais referenciado; empate, o cadastro mais antigo
+            ordem = sorted(ids, key=lambda i: (-contagem[i], i))
+            grupos.append(Grupo(ordem[0], ordem[1:], {i: nomes[i] for i in ordem}, {i: contagem[i] for i in ordem},
+                                round(similaridade, 3), locais[p]))
+    return sorted(grupos, key=lambda g: (-len(g.nomes), g.similaridade))
+
+
+def mesclar(conn, tabela, grupos):
+    """Reaponta as chaves estrangeiras de cada grupo para o canônico e apaga os duplicados.
+
+    Registra cada remoção em mesclagens, para a importação reconhecer o nome antigo. Não faz commit: o chamador decide a transação.
+    Devolve quantos cadastros foram removidos.
+    """
+    removidos = 0
+    for g in grupos:
+        for dup in g.remover:
+            if tabela == "cidades":
+                # Hospital com o mesmo nome nas duas cidades viraria duplicado (UNIQUE nome, cidade_id): mescla também
+                for h, nome in conn.execute("SELECT id, nome FROM hospitais WHERE cidade_id = ?", (dup,)).fetchall():
+                    existente = conn.execute("SELECT id FROM hospitais WHERE nome = ? AND cidade_id = ?", (nome, g.manter)).fetchone()
+                    if existente:
+                        removidos += mesclar(conn, "hospitais", [Grupo(existente[0], [h], {h: nome})])
+            for tab, fk in ENTIDADES[tabela][1]:
+                conn.execute(f"UPDATE {tab} SET {fk} = ? WHERE {fk} = ?", (g.manter, dup))
+            # Mesclagens anteriores que apontavam para o removido passam a apontar para o canônico
+            conn.execute("UPDATE mesclagens SET mantido_id = ? WHERE tabela = ? AND mantido_id = ?", (g.manter, tabela, dup))
+            conn.execute("INSERT INTO mesclagens (tabela, removido_id, removido_nome, mantido_id, mesclado_em) "
+                         "VALUES (?, ?, ?, ?, datetime('now'))", (tabela, dup, g.nomes.get(dup), g.manter))
+            conn.execute(f"DELETE FROM {tabela} WHERE id = ?", (dup,))
+            removidos += 1
+    return removidos
+
+
+def apelidos(conn, tabela):
+    """Nomes removidos por mesclagem -> id canônico, na chave dos mapas do importador (nome ou (nome, partição))."""
+    particao = ENTIDADES[tabela][0]
+    sql = (f"SELECT m.removido_nome, {'t.' + particao if particao else 'NULL'}, m.mantido_id FROM mesclagens m "
+           f"JOIN {tabela} t ON t.id = m.mantido_id WHERE m.tabela = ?")
+    return {(n, p) if particao else n: i for n, p, i in conn.execute(sql, (tabela,))}
+
+
+def nomes_antigos(conn, tabela):
+    """id canônico -> nomes que foram mesclados nele."""
+    nomes = defaultdict(list)
+    for n, i in conn.execute("SELECT removido_nome, mantido_id FROM mesclagens WHERE tabela = ?", (tabela,)):
+        nomes[i].append(n)
+    return nomes
+
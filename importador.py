@@ -0,0 +1,357 @@
+"""Motor de importação em lote da planilha MyVal (CSV ou XLSX) para o SQLite."""
+import hashlib
+import os
+import re
+from dataclasses import dataclass, field
+from datetime import date, datetime
+
+import pandas as pd
+
+from deduplicacao import apelidos, nomes_antigos
+from migracoes import migrar
+from normalizacao import COLUNAS_DERIVADAS, data_iso, gravar_originais, normalizar
+from rastreabilidade import atualizar_lotes
+
+TAMANHO_LOTE = 5000
+
+# Colunas da planilha -> colunas de texto em procedimentos
+MAPA_COLUNAS = {
+    'Data': 'data_proc', 'Patient': 'paciente', 'Age': 'idade', 'Gender': 'genero',
+    'Report': 'report_status', 'Proctor Form': 'proctor_form', 'Overnight stay': 'overnight_stay',
+    'Proctor - ECO': 'proctor_eco', 'Team Status': 'team_status', 'Anatomical details': 'anatomical_details',
+    'Access': 'access_type', 'Offlabel form': 'offlabel_form_anatomia', 'Offlabel form.1': 'offlabel_form_acesso',
+    'Myval Size': 'myval_size', 'SN': 'sn_protese', 'Navigator': 'navigator_model', 'Lot': 'navigator_lot',
+    'Mammoth': 'mammoth_model', 'Lot.1': 'mammoth_lot', 'Val de Crimp - Lot': 'val_crimp_lot',
+    'Phyton - Lot': 'phyton_lot', 'Guidewire': 'guidewire', 'Comments': 'comentarios',
+}
+
+# Colunas de pessoas -> (tabela de cadastro, chave estrangeira em procedimentos)
+MAPA_PESSOAS = {
+    'Distributor/Meril': ('distribuidores', 'distribuidor_id'),
+    'Specialist / Crimper': ('especialistas', 'specialist_id'),
+    'Proctor': ('proctors', 'proctor_id'),
+    '1st operator': ('operadores', 'op1_id'),
+    '2st operator': ('operadores', 'op2_id'),
+}
+
+COLUNAS_INSERT = ['hospital_id'] + [fk for _, fk in MAPA_PESSOAS.values()] + list(MAPA_COLUNAS.values()) + COLUNAS_DERIVADAS
+SQL_INSERT = f"INSERT INTO procedimentos ({', '.join(COLUNAS_INSERT)}) VALUES ({', '.join('?' * len(COLUNAS_INSERT))})"
+SQL_UPDATE = f"UPDATE procedimentos SET {', '.join(f'{c}=?' for c in COLUNAS_INSERT)} WHERE id=?"
+
+# Colunas da planilha que entram no hash de cada linha (detecção de alterações)
+COLUNAS_ORIGEM = ['Hospital', 'City', 'State'] + list(MAPA_PESSOAS) + list(MAPA_COLUNAS)
+RE_INTEIRO = re.compile(r'^(-?\d+)\.0+$')
+
+
+@dataclass
+class ResultadoImportacao:
+    importados: int = 0
+    atualizados: int = 0
+    inalterados: int = 0
+    rejeitados: list = field(default_factory=list)  # (linha do arquivo, motivo)
+    arquivo_inalterado: bool = False
+    sem_origem: bool = False  # carga inicial sem arquivo para importar
+
+    def resumo(self):
+        if self.arquivo_inalterado:
+            return "Arquivo já importado, nenhuma alteração"
+        if self.sem_origem:
+            return "Banco vazio: nenhum arquivo de origem para a carga inicial"
+        txt = f"{self.importados} procedimentos importados"
+        if self.atualizados or self.inalterados:
+            txt += f", {self.atualizados} atualizados, {self.inalterados} sem alteração"
+        if self.rejeitados:
+            txt += f", {len(self.rejeitados)} linhas rejeitadas"
+        return txt
+
+
+def normalizar_cabecalho(col):
+    # " Offlabel form .1" -> "Offlabel form.1" (sufixo que o pandas cria para colunas repetidas)
+    return re.sub(r'\s+(\.\d+)$', r'\1', str(col).strip())
+
+
+def preparar_lote(df):
+    df = df.rename(columns=normalizar_cabecalho)
+    return df.fillna('').astype(str).apply(lambda x: x.str.strip())
+
+
+class MapasCadastro:
+    """Mapas nome -> id dos cadastros, carregados uma vez e completados a cada lote."""
+
+    def __init__(self, conn):
+        self.conn = conn
+        # Nomes já mesclados (deduplicacao) continuam resolvendo para o cadastro mantido
+        self.cidades = apelidos(conn, 'cidades')
+        self.cidades.update({(n, uf): i for i, n, uf in conn.execute("SELECT id, nome, estado FROM cidades")})
+        self.hospitais = apelidos(conn, 'hospitais')
+        self.hospitais.update({(n, c): i for i, n, c in conn.execute("SELECT id, nome, cidade_id FROM hospitais")})
+        self.pessoas = {}
+        for tab, _ in MAPA_PESSOAS.values():
+            if tab not in self.pessoas:
+                self.pessoas[tab] = apelidos(conn, tab)
+                self.pessoas[tab].update({n: i for i, n in conn.execute(f"SELECT id, nome FROM {tab}")})
+
+    def _inserir_novos(self, tabela, colunas, chaves):
+        # Insere só o que falta e lê de volta apenas as linhas novas (id > maior id anterior)
+        ultimo = self.conn.execute(f"SELECT coalesce(max(id), 0) FROM {tabela}").fetchone()[0]
+        marc = ', '.join('?' * len(colunas))
+        self.conn.executemany(f"INSERT OR IGNORE INTO {tabela} ({', '.join(colunas)}) VALUES ({marc})", chaves)
+        return self.conn.execute(f"SELECT id, {', '.join(colunas)} FROM {tabela} WHERE id > ?", (ultimo,)).fetchall()
+
+    def completar(self, df):
+        if 'City' in df.columns:
+            novas = {(r.City, r.State) for r in df[['City', 'State']].drop_duplicates().itertuples() if r.City}
+            novas = [k for k in novas if k not in self.cidades]
+            if novas:
+                for i, n, uf in self._inserir_novos('cidades', ('nome', 'estado'), novas):
+                    self.cidades[(n, uf)] = i
+        if 'Hospital' in df.columns:
+            novos = set()
+            for r in df[['Hospital', 'City', 'State']].drop_duplicates().itertuples():
+                cid = self.cidades.get((r.City, r.State))
+                if r.Hospital and cid is not None and (r.Hospital, cid) not in self.hospitais:
+                    novos.add((r.Hospital, cid))
+            if novos:
+                for i, n, c in self._inserir_novos('hospitais', ('nome', 'cidade_id'), list(novos)):
+                    self.hospitais[(n, c)] = i
+        for col, (tab, _) in MAPA_PESSOAS.items():
+            if col in df.columns:
+                mapa = self.pessoas[tab]
+                novos = [(v,) for v in df[col].unique() if v and v not in mapa]
+                if novos:
+                    for i, n in self._inserir_novos(tab, ('nome',), novos):
+                        mapa[n] = i
+
+    def hospital(self, nome, cidade, uf):
+        cid = self.cidades.get((cidade, uf))
+        return self.hospitais.get((nome, cid)) if cid is not None else None
+
+
+def chave_procedimento(sn, data, paciente, hospital):
+    # SN da prótese + data identificam o caso; sem SN válido ("", "-", "No"), usa paciente e hospital.
+    # A data entra normalizada: o banco guarda ISO e o arquivo pode vir em outro formato.
+    data = data_iso(data) or data
+    if re.search(r'\d', sn or ''):
+        return f"{sn}|{data}"
+    return f"{data}|{paciente or ''}|{hospital or ''}"
+
+
+def chave_registro(reg):
+    return chave_procedimento(reg.get('SN'), reg.get('Data'), reg.get('Patient'), reg.get('Hospital'))
+
+
+def hash_linha(reg):
+    # Mesmo dado, mesmo hash no CSV e no XLSX: a exportação CSV escreve "77.0" onde a célula da planilha é 77
+    return hashlib.sha1('\x1f'.join(RE_INTEIRO.sub(r'\1', reg.get(c, '')) for c in COLUNAS_ORIGEM).encode('utf-8')).hexdigest()
+
+
+def carregar_chaves(conn):
+    rows = conn.execute("""SELECT p.id, p.sn_protese, p.data_proc, p.paciente, p.hospital_id, h.nome, o.hash_linha
+        FROM procedimentos p
+        LEFT JOIN hospitais h ON p.hospital_id = h.id
+        LEFT JOIN procedimentos_origem o ON o.procedimento_id = p.id""")
+    # Sem SN a chave usa o nome do hospital: o arquivo ainda pode trazer o nome de um hospital já mesclado
+    antigos = nomes_antigos(conn, 'hospitais')
+    chaves = {}
+    for i, sn, dt, pc, hid, hp, hl in rows:
+        chaves[chave_procedimento(sn, dt, pc, hp)] = (i, hl)
+        for nome in antigos.get(hid, ()):
+            chaves.setdefault(chave_procedimento(sn, dt, pc, nome), (i, hl))
+    return chaves
+
+
+def assinatura_arquivo(arquivo):
+    h = hashlib.sha256()
+    if hasattr(arquivo, 'read'):
+        pos = arquivo.tell()
+        for bloco in iter(lambda: arquivo.read(1 << 20), b''):
+            h.update(bloco)
+        arquivo.seek(pos)
+    else:
+        with open(arquivo, 'rb') as f:
+            for bloco in iter(lambda: f.read(1 << 20), b''):
+                h.update(bloco)
+    return h.hexdigest()
+
+
+def ja_importado(conn, nome, assinatura):
+    migrar(conn)
+    r = conn.execute("SELECT assinatura FROM importacoes WHERE arquivo = ?", (nome,)).fetchone()
+    return r is not None and r[0] == assinatura
+
+
+def motivo_rejeicao(reg):
+    if not any(reg.values()):
+        return "linha vazia"
+    if not reg.get('Data'):
+        return "data do procedimento ausente"
+    return None
+
+
+def valores_procedimento(mapas, reg):
+    """Valores na ordem de COLUNAS_INSERT, já normalizados, e os brutos que a normalização alterou."""
+    valores, originais = normalizar({coluna: reg.get(col) for col, coluna in MAPA_COLUNAS.items()})
+    return ([mapas.hospital(reg.get('Hospital'), reg.get('City'), reg.get('State'))]
+            + [mapas.pessoas[tab].get(reg.get(col)) for col, (tab, _) in MAPA_PESSOAS.items()]
+            + [valores[c] for c in list(MAPA_COLUNAS.values()) + COLUNAS_DERIVADAS]), originais
+
+
+def gravar_novos(conn, novos):
+    # executemany não devolve ids: os novos procedimentos são os de id acima do maior id anterior
+    ultimo = conn.execute("SELECT coalesce(max(id), 0) FROM procedimentos").fetchone()[0]
+    conn.executemany(SQL_INSERT, [v for v, _, _ in novos])
+    ids = [r[0] for r in conn.execute("SELECT id FROM procedimentos WHERE id > ? ORDER BY id", (ultimo,))]
+    conn.executemany("INSERT OR REPLACE INTO procedimentos_origem (procedimento_id, hash_linha) VALUES (?, ?)",
+                     [(i, h) for i, (_, _, h) in zip(ids, novos)])
+    return ids
+
+
+def importar_lotes(conn, lotes, incremental=False, marca=None):
+    """Importa um iterável de DataFrames numa única transação, em executemany por lote.
+
+    No modo incremental, procedimentos já existentes (mesma chave SN + data) são
+    atualizados só quando a linha de origem mudou; os demais são ignorados.
+    """
+    res = ResultadoImportacao()
+    linhas = 0
+    try:
+        migrar(conn)
+        # Trava de escrita já aqui, antes de ler max(id) em gravar_novos e _inserir_novos: sem ela, na
+        # primeira escrita ainda não há transação e um commit de outro processo (cli.py, app) desalinha os ids
+        if not conn.in_transaction:
+            conn.execute("BEGIN IMMEDIATE")
+        mapas = MapasCadastro(conn)
+        existentes = carregar_chaves(conn) if incremental else {}
+        vistos = set()
+        for df in lotes:
+            df = preparar_lote(df)
+            mapas.completar(df)
+            novos, alterados = [], []
+            # O índice de cada lote identifica a linha de origem (número da linha ou "aba:linha")
+            for linha, reg in zip(df.index, df.to_dict('records')):
+                linhas += 1
+                motivo = motivo_rejeicao(reg)
+                chave = chave_registro(reg) if incremental and not motivo else None
+                if chave is not None and chave in vistos:
+                    motivo = "procedimento repetido no arquivo (mesmo SN e data)"
+                if motivo:
+                    res.rejeitados.append((linha, motivo))
+                    continue
+                h = hash_linha(reg)
+                atual = existentes.get(chave) if incremental else None
+                if incremental:
+                    vistos.add(chave)
+                if atual is None:
+                    novos.append((*valores_procedimento(mapas, reg), h))
+                elif atual[1] != h:
+                    valores, originais = valores_procedimento(mapas, reg)
+                    alterados.append((valores + [atual[0]], originais, (atual[0], h)))
+                else:
+                    res.inalterados += 1
+            ids = gravar_novos(conn, novos) if novos else []
+            if alterados:
+                conn.executemany(SQL_UPDATE, [v for v, _, _ in alterados])
+                conn.executemany("INSERT OR REPLACE INTO procedimentos_origem (procedimento_id, hash_linha) VALUES (?, ?)",
+                                 [ih for _, _, ih in alterados])
+                ids += [i for _, _, (i, _) in alterados]
+            if ids:
+                atualizar_lotes(conn, ids)
+                gravar_originais(conn, list(zip(ids, [o for _, o, _ in novos] + [o for _, o, _ in alterados])))
+            res.importados += len(novos)
+            res.atualizados += len(alterados)
+        if marca:
+            conn.execute("INSERT OR REPLACE INTO importacoes (arquivo, assinatura, linhas, importado_em) VALUES (?, ?, ?, datetime('now'))",
+                         (*marca, linhas))
+        conn.commit()
+        conn.execute("PRAGMA optimize")  # atualiza as estatísticas dos índices após cargas grandes
+    except Exception:
+        conn.rollback()
+        raise
+    return res
+
+
+def lotes_csv(arquivo, tamanho_lote):
+    # keep_default_na=False: "NA" (iniciais de paciente) é texto, como na planilha, não célula vazia
+    with pd.read_csv(arquivo, sep=None, engine='python', dtype=str, encoding='utf-8', keep_default_na=False,
+                     chunksize=tamanho_lote) as leitor:
+        for df in leitor:
+            df.index = df.index + 2  # linha 1 do arquivo é o cabeçalho
+            yield df
+
+
+def texto_celula(v):
+    if v is None:
+        return ''
+    if isinstance(v, (datetime, date)):
+        return v.strftime('%Y-%m-%d')
+    if isinstance(v, float) and v.is_integer():
+        return str(int(v))
+    return str(v)
+
+
+def cabecalho_xlsx(celulas):
+    # Mesma convenção do pandas para colunas sem nome ou repetidas ("Lot", "Lot.1")
+    cols, vistos = [], {}
+    for i, v in enumerate(celulas):
+        nome = str(v).strip() if v is not None else f"Unnamed: {i}"
+        n = vistos.get(nome, 0)
+        vistos[nome] = n + 1
+        cols.append(f"{nome}.{n}" if n else nome)
+    return cols
+
+
+def lotes_xlsx(arquivo, tamanho_lote, progresso=None):
+    """Lê a planilha aba por aba em modo read-only, sem carregar o workbook inteiro."""
+    from openpyxl import load_workbook
+
+    wb = load_workbook(arquivo, read_only=True, data_only=True)
+    try:
+        for ws in wb.worksheets:
+            # Cabeçalho: primeira linha (entre as 10 primeiras) com as colunas Data e Patient
+            cols = None
+            for inicio, celulas in enumerate(ws.iter_rows(max_row=10, values_only=True), start=1):
+                nomes = [str(v).strip() for v in celulas if v is not None]
+                if 'Data' in nomes and 'Patient' in nomes:
+                    while celulas and celulas[-1] is None:
+                        celulas = celulas[:-1]
+                    cols = cabecalho_xlsx(celulas)
+                    break
+            if cols is None:
+                continue
+            buf, idx, total = [], [], 0
+            linhas = ws.iter_rows(min_row=inicio + 1, max_col=len(cols), values_only=True)
+            for n, celulas in enumerate(linhas, start=inicio + 1):
+                valores = [texto_celula(v) for v in celulas]
+                if not any(v.strip() for v in valores):
+                    continue  # linhas em branco/formatadas no fim da aba
+                buf.append(valores + [''] * (len(cols) - len(valores)))
+                idx.append(f"{ws.title}:{n}")
+                if len(buf) >= tamanho_lote:
+                    yield pd.DataFrame(buf, columns=cols, index=idx)
+                    total += len(buf)
+                    buf, idx = [], []
+            if buf:
+                yield pd.DataFrame(buf, columns=cols, index=idx)
+                total += len(buf)
+            if progresso:
+                progresso(ws.title, total)
+    finally:
+        wb.close()
+
+
+def importar_arquivo(conn, arquivo, lotes, incremental=False):
+    nome = os.path.basename(getattr(arquivo, 'name', str(arquivo)))
+    assinatura = assinatura_arquivo(arquivo)
+    if incremental and ja_importado(conn, nome, assinatura):
+        return ResultadoImportacao(arquivo_inalterado=True)
+    return importar_lotes(conn, lotes, incremental, marca=(nome, assinatura))
+
+
+def importar_csv(conn, arquivo, incremental=False, tamanho_lote=TAMANHO_LOTE):
+    """Importa um CSV (caminho ou arquivo aberto). Arquivo idêntico ao último importado não é relido."""
+    return importar_arquivo(conn, arquivo, lotes_csv(arquivo, tamanho_lote), incremental)
+
+
+def importar_xlsx(conn, arquivo, incremental=False, tamanho_lote=TAMANHO_LOTE, progresso=None):
+    """Importa todas as abas de um XLSX com o layout da planilha MyVal; progresso(aba, linhas) a cada aba."""
+    return importar_arquivo(conn, arquivo, lotes_xlsx(arquivo, tamanho_lote, progresso), incremental)
@@ -0,0 +1,149 @@
+"""Instrumentação: tempo de cada consulta e de cada página, log JSON lines e consultas lentas.
+
+Uso: python metricas.py [metricas.jsonl]  -> imprime p50/p95 por página e por consulta do log.
+"""
+import hashlib
+import json
+import math
+import os
+import re
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+
+from consultas import plano
+
+LIMIAR_LENTA_MS = float(os.environ.get("MYVAL_LIMIAR_LENTA_MS", 200))
+ARQUIVO_LOG = os.environ.get("MYVAL_LOG_METRICAS", os.path.join(os.path.dirname(os.path.abspath(__file__)), "metricas.jsonl"))
+MAX_LOG_BYTES = 10 * 1024 * 1024  # acima disso o log vira .1 e recomeça
+MAX_EVENTOS = 5000                # últimos eventos mantidos em memória para o painel
+INTERVALO_AVISO_S = 60            # no máximo um aviso de falha da instrumentação por minuto
+
+RE_LITERAIS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+RE_LISTA_MARCADORES = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+
+
+def impressao_digital(sql):
+    """SQL sem literais nem espaços extras: consultas que só mudam nos valores caem no mesmo grupo."""
+    sql = RE_LITERAIS.sub("?", " ".join(sql.split()))
+    return RE_LISTA_MARCADORES.sub("(?)", sql)  # IN (?, ?, ?) e IN (?) são a mesma consulta
+
+
+def percentil(valores, p):
+    # Nearest-rank: sempre um valor observado, sem interpolar
+    ordenados = sorted(valores)
+    return ordenados[max(0, math.ceil(p / 100 * len(ordenados)) - 1)]
+
+
+def resumir(eventos, tipo):
+    """p50/p95/máximo por consulta (impressão digital) ou por página, dos mais lentos para os mais rápidos."""
+    grupos = {}
+    for ev in eventos:
+        if ev["tipo"] == tipo:
+            grupos.setdefault(ev["chave"], []).append(ev["ms"])
+    linhas = [{"chave": k, "n": len(v), "p50_ms": percentil(v, 50), "p95_ms": percentil(v, 95), "max_ms": max(v)}
+              for k, v in grupos.items()]
+    return sorted(linhas, key=lambda r: r["p95_ms"], reverse=True)
+
+
+def ler_log(arquivo=ARQUIVO_LOG):
+    if not os.path.exists(arquivo):
+        return []
+    with open(arquivo, encoding="utf-8") as f:
+        return [json.loads(l) for l in f if l.strip()]
+
+
+class Metricas:
+    def __init__(self, arquivo=ARQUIVO_LOG, limiar_ms=LIMIAR_LENTA_MS):
+        self.arquivo = arquivo
+        self.limiar_ms = limiar_ms
+        self.eventos = deque(maxlen=MAX_EVENTOS)
+        self._trava = threading.Lock()
+        self._ultimo_aviso = 0.0
+
+    def _avisar(self, msg):
+        # Falha da instrumentação vai para o stderr, sem inundar: a consulta medida segue normalmente
+        agora = time.monotonic()
+        if agora - self._ultimo_aviso >= INTERVALO_AVISO_S:
+            self._ultimo_aviso = agora
+            print(f"metricas: {msg}", file=sys.stderr, flush=True)
+
+    def registrar(self, evento):
+        """Guarda o evento em memória e acrescenta ao log. Erro de arquivo só perde a linha do log."""
+        evento = {"em": datetime.now().isoformat(timespec="milliseconds"), **evento}
+        with self._trava:
+            self.eventos.append(evento)
+            if not self.arquivo:
+                return
+            try:
+                with open(self.arquivo, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(evento, ensure_ascii=False, default=str) + "\n")
+                    cheio = f.tell() > MAX_LOG_BYTES
+                if cheio:
+                    os.replace(self.arquivo, self.arquivo + ".1")
+            except OSError as e:
+                self._avisar(f"log {self.arquivo} indisponível: {e}")
+
+    @contextmanager
+    def consulta(self, conn, sql, params=()):
+        """Mede o bloco que executa `sql` em `conn`. Quem chama preenche m["linhas"].
+
+        Acima do limiar, o evento leva também o EXPLAIN QUERY PLAN da consulta. Nenhuma falha da
+        medição chega a quem chama: o resultado (ou a exceção) do bloco é sempre o da consulta.
+        """
+        m = {"linhas": None}
+        erro = None
+        inicio = time.perf_counter()
+        try:
+            yield m
+        except BaseException as e:
+            erro = type(e).__name__
+            raise
+        finally:
+            try:
+                self._registrar_consulta(conn, sql, params, m, erro, round((time.perf_counter() - inicio) * 1000, 2))
+            except Exception as e:
+                self._avisar(f"falha ao medir consulta: {e!r}")
+
+    def _registrar_consulta(self, conn, sql, params, m, erro, ms):
+        digital = impressao_digital(sql)
+        ev = {"tipo": "consulta", "chave": digital, "id": hashlib.sha1(digital.encode()).hexdigest()[:10],
+              "params": len(params), "linhas": m["linhas"], "ms": ms}
+        if erro:
+            ev["erro"] = erro
+        if ms >= self.limiar_ms:
+            ev["lenta"] = True
+            try:
+                ev["plano"] = plano(conn, sql)
+            except Exception as e:
+                ev["plano"] = [f"(sem plano: {e})"]
+        self.registrar(ev)
+
+    def pagina(self, nome, inicio):
+        """Registra a renderização de uma página iniciada em `inicio` (time.perf_counter())."""
+        try:
+            self.registrar({"tipo": "pagina", "chave": nome, "ms": round((time.perf_counter() - inicio) * 1000, 2)})
+        except Exception as e:
+            self._avisar(f"falha ao medir página: {e!r}")
+
+    def resumo(self, tipo):
+        return resumir(list(self.eventos), tipo)
+
+    def lentas(self, limite=20):
+        return [ev for ev in reversed(self.eventos) if ev.get("lenta")][:limite]
+
+
+# Um coletor por processo, compartilhado pelas sessões (como o gerenciador de conexões)
+coletor = Metricas()
+
+
+if __name__ == "__main__":
+    eventos = ler_log(sys.argv[1] if len(sys.argv) > 1 else ARQUIVO_LOG)
+    for tipo in ("pagina", "consulta"):
+        print(f"== {tipo} ==")
+        for r in resumir(eventos, tipo):
+            print(f"{r['p50_ms']:>9.2f} {r['p95_ms']:>9.2f} {r['max_ms']:>9.2f} {r['n']:>6}  {r['chave'][:120]}")
+        print()
@@ -0,0 +1,161 @@
+"""Migrações versionadas do esquema SQLite (PRAGMA user_version)."""
+from normalizacao import normalizar_existentes
+from rastreabilidade import atualizar_lotes
+
+
+def adicionar_coluna(conn, tabela, coluna, tipo):
+    # ALTER TABLE ADD COLUMN não tem IF NOT EXISTS: confere antes para o passo ser idempotente
+    if coluna not in {r[1] for r in conn.execute(f"PRAGMA table_info({tabela})")}:
+        conn.execute(f"ALTER TABLE {tabela} ADD COLUMN {coluna} {tipo}")
+
+
+# (versão, descrição, passos). Cada passo é um SQL ou uma função que recebe a conexão.
+# Nunca altere uma migração já publicada: acrescente uma nova versão no fim da lista.
+MIGRACOES = [
+    (1, "Esquema inicial", [
+        "CREATE TABLE IF NOT EXISTS cidades (id INTEGER PRIMARY KEY, nome TEXT, estado TEXT, UNIQUE(nome, estado))",
+        "CREATE TABLE IF NOT EXISTS hospitais (id INTEGER PRIMARY KEY, nome TEXT, cidade_id INTEGER, FOREIGN KEY(cidade_id) REFERENCES cidades(id), UNIQUE(nome, cidade_id))",
+        "CREATE TABLE IF NOT EXISTS distribuidores (id INTEGER PRIMARY KEY, nome TEXT UNIQUE)",
+        "CREATE TABLE IF NOT EXISTS especialistas (id INTEGER PRIMARY KEY, nome TEXT UNIQUE)",
+        "CREATE TABLE IF NOT EXISTS proctors (id INTEGER PRIMARY KEY, nome TEXT UNIQUE)",
+        "CREATE TABLE IF NOT EXISTS operadores (id INTEGER PRIMARY KEY, nome TEXT UNIQUE)",
+        """CREATE TABLE IF NOT EXISTS procedimentos (
+            id INTEGER PRIMARY KEY, data_proc DATE, paciente TEXT, idade TEXT, genero TEXT,
+            hospital_id INTEGER, distribuidor_id INTEGER, specialist_id INTEGER, proctor_id INTEGER,
+            op1_id INTEGER, op2_id INTEGER, report_status TEXT, proctor_form TEXT, overnight_stay TEXT, proctor_eco TEXT,
+            team_status TEXT, anatomical_details TEXT, access_type TEXT, offlabel_form_anatomia TEXT, offlabel_form_acesso TEXT,
+            myval_size TEXT, sn_protese TEXT, navigator_model TEXT, navigator_lot TEXT, mammoth_model TEXT, mammoth_lot TEXT,
+            val_crimp_lot TEXT, phyton_lot TEXT, guidewire TEXT, comentarios TEXT, FOREIGN KEY(hospital_id) REFERENCES hospitais(id))""",
+    ]),
+    (2, "Controle da importação incremental", [
+        # Hash da linha de origem de cada procedimento e marca d'água por arquivo importado
+        "CREATE TABLE IF NOT EXISTS procedimentos_origem (procedimento_id INTEGER PRIMARY KEY, hash_linha TEXT)",
+        "CREATE TABLE IF NOT EXISTS importacoes (arquivo TEXT PRIMARY KEY, assinatura TEXT, linhas INTEGER, importado_em TEXT)",
+    ]),
+    (3, "Índices de procedimentos", [
+        # Cobre a consulta do Dashboard inteira (filtro por data + chaves dos JOINs + colunas lidas)
+        "CREATE INDEX IF NOT EXISTS idx_proc_dashboard ON procedimentos(data_proc, hospital_id, distribuidor_id, specialist_id, genero, team_status)",
+        "CREATE INDEX IF NOT EXISTS idx_proc_hospital ON procedimentos(hospital_id)",
+        "CREATE INDEX IF NOT EXISTS idx_proc_distribuidor ON procedimentos(distribuidor_id)",
+        "CREATE INDEX IF NOT EXISTS idx_proc_especialista ON procedimentos(specialist_id)",
+        "CREATE INDEX IF NOT EXISTS idx_proc_proctor ON procedimentos(proctor_id)",
+        "CREATE INDEX IF NOT EXISTS idx_hospitais_cidade ON hospitais(cidade_id)",
+        "ANALYZE",
+    ]),
+    (4, "Índice para a paginação da Consulta", [
+        # (data_proc, rowid): percorre a ordem (data_proc DESC, id DESC) e busca a próxima página sem ordenar
+        "CREATE INDEX IF NOT EXISTS idx_proc_data ON procedimentos(data_proc)",
+    ]),
+    (5, "Busca textual (FTS5) em paciente, comentários, anatomia, acesso e guidewire", [
+        # Índice de conteúdo externo: o texto fica só em procedimentos, os gatilhos mantêm o índice.
+        # remove_diacritics faz "pos dilatacao" encontrar "Pós dilatação"; prefix acelera buscas por prefixo.
+        """CREATE VIRTUAL TABLE IF NOT EXISTS procedimentos_fts USING fts5(
+            paciente, comentarios, anatomical_details, access_type, guidewire,
+            content='procedimentos', content_rowid='id',
+            tokenize="unicode61 remove_diacritics 2", prefix='2 3')""",
+        """CREATE TRIGGER IF NOT EXISTS procedimentos_fts_ai AFTER INSERT ON procedimentos BEGIN
+            INSERT INTO procedimentos_fts(rowid, paciente, comentarios, anatomical_details, access_type, guidewire)
+            VALUES (new.id, new.paciente, new.comentarios, new.anatomical_details, new.access_type, new.guidewire);
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS procedimentos_fts_ad AFTER DELETE ON procedimentos BEGIN
+            INSERT INTO procedimentos_fts(procedimentos_fts, rowid, paciente, comentarios, anatomical_details, access_type, guidewire)
+            VALUES ('delete', old.id, old.paciente, old.comentarios, old.anatomical_details, old.access_type, old.guidewire);
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS procedimentos_fts_au AFTER UPDATE ON procedimentos BEGIN
+            INSERT INTO procedimentos_fts(procedimentos_fts, rowid, paciente, comentarios, anatomical_details, access_type, guidewire)
+            VALUES ('delete', old.id, old.paciente, old.comentarios, old.anatomical_details, old.access_type, old.guidewire);
+            INSERT INTO procedimentos_fts(rowid, paciente, comentarios, anatomical_details, access_type, guidewire)
+            VALUES (new.id, new.paciente, new.comentarios, new.anatomical_details, new.access_type, new.guidewire);
+        END""",
+        "INSERT INTO procedimentos_fts(procedimentos_fts) VALUES ('rebuild')",
+        # Relevância: acerto no paciente pesa mais que nos campos clínicos
+        "INSERT INTO procedimentos_fts(procedimentos_fts, rank) VALUES ('rank', 'bm25(10.0, 1.0, 1.0, 1.0, 1.0)')",
+    ]),
+    (6, "Registro de lotes para rastreabilidade", [
+        # Um registro por (lote normalizado, coluna de origem, procedimento); mantido pelo app e pela importação
+        """CREATE TABLE IF NOT EXISTS lotes (
+            lote TEXT NOT NULL, tipo TEXT NOT NULL, procedimento_id INTEGER NOT NULL REFERENCES procedimentos(id),
+            PRIMARY KEY (lote, tipo, procedimento_id)) WITHOUT ROWID""",
+        "CREATE INDEX IF NOT EXISTS idx_lotes_procedimento ON lotes(procedimento_id)",
+        """CREATE TRIGGER IF NOT EXISTS lotes_ad AFTER DELETE ON procedimentos BEGIN
+            DELETE FROM lotes WHERE procedimento_id = old.id;
+        END""",
+        """CREATE VIEW IF NOT EXISTS v_rastreabilidade AS
+            SELECT l.lote, l.tipo, p.id as procedimento_id, p.data_proc, p.paciente,
+                   h.nome as hospital, c.nome as cidade, c.estado as uf,
+                   o1.nome as operador_1, o2.nome as operador_2, s.nome as especialista, d.nome as distribuidor
+            FROM lotes l
+            JOIN procedimentos p ON p.id = l.procedimento_id
+            LEFT JOIN hospitais h ON p.hospital_id = h.id
+            LEFT JOIN cidades c ON h.cidade_id = c.id
+            LEFT JOIN operadores o1 ON p.op1_id = o1.id
+            LEFT JOIN operadores o2 ON p.op2_id = o2.id
+            LEFT JOIN especialistas s ON p.specialist_id = s.id
+            LEFT JOIN distribuidores d ON p.distribuidor_id = d.id""",
+        atualizar_lotes,
+    ]),
+    (7, "Colunas normalizadas: datas ISO, idade e tamanho numéricos, categorias canônicas", [
+        lambda conn: adicionar_coluna(conn, "procedimentos", "idade_anos", "INTEGER"),
+        lambda conn: adicionar_coluna(conn, "procedimentos", "myval_mm", "REAL"),
+        # Valor bruto de cada campo que a normalização alterou (auditoria)
+        """CREATE TABLE IF NOT EXISTS valores_originais (
+            procedimento_id INTEGER NOT NULL REFERENCES procedimentos(id), coluna TEXT NOT NULL, valor TEXT,
+            PRIMARY KEY (procedimento_id, coluna)) WITHOUT ROWID""",
+        """CREATE TRIGGER IF NOT EXISTS valores_originais_ad AFTER DELETE ON procedimentos BEGIN
+            DELETE FROM valores_originais WHERE procedimento_id = old.id;
+        END""",
+        normalizar_existentes,
+        "ANALYZE procedimentos",
+    ]),
+    (8, "Histórico de mesclagens de cadastros duplicados", [
+        # O nome removido continua valendo na importação, apontando para o cadastro mantido
+        """CREATE TABLE IF NOT EXISTS mesclagens (
+            id INTEGER PRIMARY KEY, tabela TEXT NOT NULL, removido_id INTEGER NOT NULL, removido_nome TEXT,
+            mantido_id INTEGER NOT NULL, mesclado_em TEXT NOT NULL)""",
+        "CREATE INDEX IF NOT EXISTS idx_mesclagens_tabela ON mesclagens(tabela, mantido_id)",
+    ]),
+    (9, "Índice FTS atualizado só quando muda uma coluna indexada", [
+        # O gatilho da v5 reescrevia a linha do FTS em todo UPDATE (chaves estrangeiras, mesclagens, normalização)
+        "DROP TRIGGER IF EXISTS procedimentos_fts_au",
+        """CREATE TRIGGER procedimentos_fts_au
+            AFTER UPDATE OF paciente, comentarios, anatomical_details, access_type, guidewire ON procedimentos BEGIN
+            INSERT INTO procedimentos_fts(procedimentos_fts, rowid, paciente, comentarios, anatomical_details, access_type, guidewire)
+            VALUES ('delete', old.id, old.paciente, old.comentarios, old.anatomical_details, old.access_type, old.guidewire);
+            INSERT INTO procedimentos_fts(rowid, paciente, comentarios, anatomical_details, access_type, guidewire)
+            VALUES (new.id, new.paciente, new.comentarios, new.anatomical_details, new.access_type, new.guidewire);
+        END""",
+    ]),
+]
+
+VERSAO_ATUAL = MIGRACOES[-1][0]
+
+
+def versao(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrar(conn):
+    """Aplica, em ordem, as migrações acima da versão gravada no banco. Devolve as versões aplicadas."""
+    aplicadas = []
+    atual = versao(conn)
+    if atual >= VERSAO_ATUAL:
+        return aplicadas
+    conn.commit()
+    for v, _, passos in MIGRACOES:
+        if v <= atual:
+            continue
+        # Cada versão numa transação: ou entra inteira (com o user_version) ou não entra
+        conn.execute("BEGIN")
+        try:
+            for passo in passos:
+                if callable(passo):
+                    passo(conn)
+                else:
+                    conn.execute(passo)
+            conn.execute(f"PRAGMA user_version = {v}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        aplicadas.append(v)
+    return aplicadas
@@ -0,0 +1,110 @@
+"""Normalização dos campos de procedimentos: datas ISO, idade e tamanho numéricos, categorias canônicas.
+
+Aplicada na importação e no formulário. Data e categorias são gravadas já normalizadas e o
+valor bruto que mudou vai para valores_originais; idade e tamanho ganham colunas numéricas
+(idade_anos, myval_mm) ao lado do texto original.
+"""
+import re
+from datetime import date, datetime
+
+FORMATOS_DATA = ('%Y-%m-%d', '%d/%m/%Y', '%Y/%m/%d', '%d-%m-%Y', '%d.%m.%Y', '%d/%m/%y')
+RE_NUMERO = re.compile(r"\d+(?:[.,]\d*)?")
+
+SIM_NAO = {'yes': 'Yes', 'y': 'Yes', 'sim': 'Yes', 'no': 'No', 'no.': 'No', 'n': 'No', 'nao': 'No', 'não': 'No'}
+NECESSIDADE = {'not necessary': 'Not necessary', 'not needed': 'Not necessary', 'necessary': 'Necessary',
+               'yes': 'Yes', 'pendente': 'Pendente'}
+# Valor em minúsculas e com espaços simples -> forma canônica. O que não está no mapa fica como veio.
+CATEGORIAS = {
+    'genero': {'male': 'Male', 'm': 'Male', 'masculino': 'Male', 'female': 'Female', 'f': 'Female', 'feminino': 'Female'},
+    'team_status': {'certified': 'Certified', 'certificate': 'Certified', 'not certified': 'Not Certified',
+                    'no certified': 'Not Certified', 'uncertified': 'Not Certified', 'proctoring': 'Proctoring'},
+    'proctor_form': SIM_NAO,
+    'proctor_eco': SIM_NAO,
+    'offlabel_form_anatomia': NECESSIDADE,
+    'offlabel_form_acesso': NECESSIDADE,
+}
+COLUNAS_DERIVADAS = ['idade_anos', 'myval_mm']
+# Colunas de procedimentos que a normalização lê
+COLUNAS_BRUTAS = ['data_proc', 'idade', 'myval_size'] + list(CATEGORIAS)
+
+
+def data_iso(valor):
+    """'02/01/2025', '2025-01-02 00:00:00' ou date -> '2025-01-02'; None se não reconhecer."""
+    if isinstance(valor, date):
+        return valor.strftime('%Y-%m-%d')
+    partes = str(valor or '').split()
+    for f in FORMATOS_DATA:
+        try:
+            return datetime.strptime(partes[0], f).strftime('%Y-%m-%d')
+        except (ValueError, IndexError):
+            continue
+    return None
+
+
+def numero(valor):
+    # Primeiro número do texto, com vírgula ou ponto decimal: "27,5mm" -> 27.5, "30.5mm/32mm" -> 30.5
+    m = RE_NUMERO.search(str(valor or ''))
+    return float(m.group().replace(',', '.')) if m else None
+
+
+def idade_anos(valor):
+    n = numero(valor)
+    return int(n) if n is not None and 0 < n < 120 else None
+
+
+def tamanho_mm(valor):
+    # Válvulas MyVal vão de 20 a 32 mm; fora de uma faixa folgada é lixo ("No", "x", lote no campo errado)
+    n = numero(valor)
+    return n if n is not None and 15 <= n <= 40 else None
+
+
+def categoria(coluna, valor):
+    chave = ' '.join(str(valor or '').split()).lower()
+    return CATEGORIAS[coluna].get(chave, valor)
+
+
+def normalizar(valores):
+    """{coluna: valor bruto} -> (valores normalizados + colunas derivadas, {coluna: bruto que mudou}).
+
+    Colunas ausentes em `valores` não são tocadas (nem suas derivadas).
+    """
+    saida, originais = dict(valores), {}
+
+    def trocar(coluna, novo):
+        bruto = valores[coluna]
+        if novo is not None and novo != bruto:
+            saida[coluna] = novo
+            if isinstance(bruto, str) and bruto:
+                originais[coluna] = bruto
+
+    if 'data_proc' in valores:
+        trocar('data_proc', data_iso(valores['data_proc']))
+    for coluna in CATEGORIAS:
+        if coluna in valores:
+            trocar(coluna, categoria(coluna, valores[coluna]))
+    if 'idade' in valores:
+        saida['idade_anos'] = idade_anos(valores['idade'])
+    if 'myval_size' in valores:
+        saida['myval_mm'] = tamanho_mm(valores['myval_size'])
+    return saida, originais
+
+
+def gravar_originais(conn, originais):
+    """[(procedimento_id, {coluna: bruto})]: substitui os brutos guardados desses procedimentos. Não faz commit."""
+    conn.executemany("DELETE FROM valores_originais WHERE procedimento_id = ?", [(i,) for i, _ in originais])
+    conn.executemany("INSERT INTO valores_originais (procedimento_id, coluna, valor) VALUES (?, ?, ?)",
+                     [(i, c, v) for i, o in originais for c, v in o.items()])
+
+
+def normalizar_existentes(conn):
+    """Normaliza no lugar os procedimentos já gravados (migração). Não faz commit."""
+    colunas = COLUNAS_BRUTAS + COLUNAS_DERIVADAS
+    linhas = conn.execute(f"SELECT id, {', '.join(COLUNAS_BRUTAS)} FROM procedimentos").fetchall()
+    novos, originais = [], []
+    for i, *brutos in linhas:
+        valores, orig = normalizar(dict(zip(COLUNAS_BRUTAS, brutos)))
+        novos.append([valores[c] for c in colunas] + [i])
+        if orig:
+            originais.append((i, orig))
+    conn.executemany(f"UPDATE procedimentos SET {', '.join(f'{c}=?' for c in colunas)} WHERE id=?", novos)
+    gravar_originais(conn, originais)
@@ -0,0 +1,61 @@
+"""Registro de lotes e números de série por procedimento, para investigação de recall."""
+import json
+import re
+
+import pandas as pd
+
+from consultas import SQL_RASTREABILIDADE
+
+# Colunas de procedimentos com lote/série (tipo gravado no registro = nome da coluna)
+COLUNAS_LOTE = ["sn_protese", "navigator_lot", "mammoth_lot", "val_crimp_lot", "phyton_lot"]
+# Guidewire é modelo, não lote: entra inteiro, sem exigir dígitos
+COLUNAS_MODELO = ["guidewire"]
+
+# "PMTDE43 / PMTDE80", "MVB45290054 - MVB58290008", "PVLDCI52/PVLDCI52"
+RE_SEPARADORES = re.compile(r"\s*[/,;]\s*|\s+-\s+|\s+e\s+", re.I)
+SEM_PRODUTO = {"", "-", "X", "NO", "NA", "N/A", "NOTUSED", "NAOUSADO"}
+
+
+def normalizar_lote(valor):
+    # Maiúsculas e sem espaços: "MVB 79275013" e "mvb79275013" são o mesmo lote
+    return re.sub(r"\s+", "", str(valor or "")).upper()
+
+
+def lotes_da_linha(valores):
+    """(tipo, lote) de uma linha com os valores de COLUNAS_LOTE + COLUNAS_MODELO, nessa ordem."""
+    saida = set()
+    for tipo, valor in zip(COLUNAS_LOTE, valores):
+        for parte in RE_SEPARADORES.split(valor or ""):
+            lote = normalizar_lote(parte)
+            if re.search(r"\d", lote):  # lotes e SNs sempre têm dígitos; "Not Used", "No" ficam de fora
+                saida.add((tipo, lote))
+    for tipo, valor in zip(COLUNAS_MODELO, valores[len(COLUNAS_LOTE):]):
+        modelo = normalizar_lote(valor)
+        if modelo not in SEM_PRODUTO:
+            saida.add((tipo, modelo))
+    return saida
+
+
+def atualizar_lotes(conn, ids=None):
+    """Refaz o registro de lotes dos procedimentos `ids` (ou de todos, se None). Não faz commit."""
+    cols = ", ".join(COLUNAS_LOTE + COLUNAS_MODELO)
+    if ids is None:
+        conn.execute("DELETE FROM lotes")
+        linhas = conn.execute(f"SELECT id, {cols} FROM procedimentos").fetchall()
+    else:
+        lista = json.dumps([int(i) for i in ids])
+        conn.execute("DELETE FROM lotes WHERE procedimento_id IN (SELECT value FROM json_each(?))", (lista,))
+        linhas = conn.execute(f"SELECT id, {cols} FROM procedimentos WHERE id IN (SELECT value FROM json_each(?))", (lista,)).fetchall()
+    conn.executemany("INSERT OR IGNORE INTO lotes (lote, tipo, procedimento_id) VALUES (?, ?, ?)",
+                     [(lote, tipo, r[0]) for r in linhas for tipo, lote in lotes_da_linha(r[1:])])
+
+
+def ler_lista_lotes(texto):
+    # Um lote por linha (ou separados por vírgula / ponto e vírgula), como vem do aviso de recall
+    return sorted({normalizar_lote(v) for v in re.split(r"[\n,;]+", texto or "") if normalizar_lote(v)})
+
+
+def procedimentos_por_lotes(conn, lotes):
+    """Todos os procedimentos expostos a qualquer um dos lotes, numa única consulta."""
+    lista = json.dumps(sorted({normalizar_lote(l) for l in lotes}))
+    return pd.read_sql(SQL_RASTREABILIDADE, conn, params=(lista,))
@@ -0,0 +1,187 @@
+"""Relatórios PDF de procedimentos.
+
+Não depende do Streamlit: os processos da exportação em lote importam só este módulo.
+"""
+import hashlib
+import multiprocessing
+import os
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain, islice
+
+from fpdf import FPDF
+
+LOGO_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "logo.png") # Salve o logo da Meril com este nome na pasta
+MIN_LOTE_PARALELO = 20    # abaixo disso, subir os processos custa mais do que renderizar direto
+JANELA_POR_PROCESSO = 8   # documentos prontos ou em andamento por processo: limita a memória do lote
+
+_logos = {}
+
+
+def logo_decodificado(caminho=LOGO_FILE):
+    """Imagem já decodificada pelo FPDF, lida do disco uma vez por processo (None se não existir)."""
+    if caminho not in _logos:
+        info = None
+        if os.path.exists(caminho):
+            doc = FPDF()
+            doc.add_page()
+            try:
+                doc.image(caminho, 0, 0, 1)
+                info = doc.images[caminho]
+            except RuntimeError:
+                pass  # formato que o FPDF não lê: relatório sai sem logo em vez de não sair
+        _logos[caminho] = info
+    return _logos[caminho]
+
+
+# Campos de uma linha de sql_consulta que aparecem no relatório
+CAMPOS_RELATORIO = ['id', 'paciente', 'data_proc', 'Hospital', 'Cidade', 'UF', 'Especialista', 'Proctor',
+                    'myval_size', 'sn_protese', 'team_status', 'anatomical_details', 'comentarios']
+
+
+def assinatura_registro(dados_dict):
+    """Hash dos campos impressos: muda quando o relatório do procedimento mudaria."""
+    return hashlib.sha1(repr([str(dados_dict[c]) for c in CAMPOS_RELATORIO]).encode()).hexdigest()
+
+
+def texto(valor, vazio="-"):
+    # As fontes padrão do FPDF são latin-1: caracteres fora dela viram "?" em vez de derrubar o documento
+    return (str(valor) if valor else vazio).encode("latin-1", "replace").decode("latin-1")
+
+
+class PDF(FPDF):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Semeia o cache de imagens do documento: o header não relê nem decodifica o logo a cada página
+        self.logo = logo_decodificado()
+        if self.logo:
+            self.images[LOGO_FILE] = dict(self.logo, i=1)
+
+    def header(self):
+        # Logo
+        if self.logo:
+            self.image(LOGO_FILE, 10, 8, 33)
+        self.set_font('Arial', 'B', 15)
+        self.set_text_color(0, 59, 115) # Azul Meril
+        self.cell(80)
+        self.cell(30, 10, 'Relatório de Procedimento Cirúrgico', 0, 0, 'C')
+        self.ln(20)
+
+    def footer(self):
+        self.set_y(-15)
+        self.set_font('Arial', 'I', 8)
+        self.set_text_color(128)
+        self.cell(0, 10, 'Meril Life Sciences - Surgical Intelligence System | Página ' + str(self.page_no()), 0, 0, 'C')
+
+
+def escrever_registro(pdf, dados_dict):
+    """Acrescenta ao documento a(s) página(s) de um procedimento (linha de sql_consulta)."""
+    pdf.add_page()
+    pdf.set_auto_page_break(auto=True, margin=15)
+
+    # Título do Paciente
+    pdf.set_fill_color(0, 174, 239) # Azul Ciano
+    pdf.set_text_color(255, 255, 255)
+    pdf.set_font("Arial", "B", 12)
+    pdf.cell(0, 10, texto(f" Protocolo #{dados_dict['id']} - Paciente: {dados_dict['paciente']} ({dados_dict['data_proc']})"), 0, 1, 'L', fill=True)
+    pdf.ln(5)
+
+    # Corpo
+    pdf.set_text_color(0, 0, 0)
+    pdf.set_font("Arial", "", 10)
+
+    colunas = [
+        ("Hospital", dados_dict['Hospital']), ("Cidade/UF", f"{texto(dados_dict['Cidade'])}/{texto(dados_dict['UF'])}"),
+        ("Especialista", dados_dict['Especialista']), ("Proctor", dados_dict['Proctor']),
+        ("MyVal Size", dados_dict['myval_size']), ("Serial Number", dados_dict['sn_protese']),
+        ("Team Status", dados_dict['team_status']), ("Anatomia", dados_dict['anatomical_details'])
+    ]
+
+    for label, valor in colunas:
+        pdf.set_font("Arial", "B", 10)
+        pdf.cell(40, 8, label + ":", 0, 0)
+        pdf.set_font("Arial", "", 10)
+        pdf.multi_cell(0, 8, texto(valor))
+
+    pdf.ln(5)
+    pdf.set_font("Arial", "B", 11)
+    pdf.cell(0, 10, "Comentários Clínicos:", 0, 1)
+    pdf.set_font("Arial", "", 10)
+    pdf.multi_cell(0, 6, texto(dados_dict['comentarios'], "Sem observações adicionais."))
+
+
+def gerar_pdf(dados_dict):
+    pdf = PDF()
+    escrever_registro(pdf, dados_dict)
+    # Salva em memória temporária
+    return pdf.output(dest="S").encode("latin-1")
+
+
+def _renderizar(dados_dict):
+    try:
+        return dados_dict['id'], gerar_pdf(dados_dict), None
+    except Exception as e:
+        return dados_dict['id'], None, str(e)
+
+
+def renderizar_lote(registros, processos=None):
+    """Gera (id, pdf, erro) na ordem de `registros`, em paralelo quando o lote compensa.
+
+    No máximo JANELA_POR_PROCESSO documentos por processo ficam em memória esperando
+    o consumidor; os registros também são lidos sob demanda.
+    """
+    registros = iter(registros)
+    processos = processos or os.cpu_count() or 1
+    inicio = list(islice(registros, MIN_LOTE_PARALELO))
+    if processos == 1 or len(inicio) < MIN_LOTE_PARALELO:
+        yield from map(_renderizar, chain(inicio, registros))
+        return
+    # spawn: fork de um processo com threads (o servidor do Streamlit) não é seguro
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(processos, mp_context=ctx, initializer=logo_decodificado) as ex:
+        pendentes = deque()
+        for dados in chain(inicio, registros):
+            pendentes.append(ex.submit(_renderizar, dados))
+            if len(pendentes) >= processos * JANELA_POR_PROCESSO:
+                yield pendentes.popleft().result()
+        while pendentes:
+            yield pendentes.popleft().result()
+
+
+def exportar_zip(registros, destino, processos=None, progresso=None):
+    """Um PDF por procedimento dentro de um ZIP gravado em `destino` (caminho ou arquivo binário).
+
+    Cada documento vai para o ZIP assim que fica pronto. Devolve {id: erro} dos que falharam,
+    que também ficam listados em erros.txt dentro do ZIP.
+    """
+    erros = {}
+    with zipfile.ZipFile(destino, "w", zipfile.ZIP_STORED) as zf:
+        for n, (rid, pdf, erro) in enumerate(renderizar_lote(registros, processos), 1):
+            if erro:
+                erros[rid] = erro
+            else:
+                zf.writestr(f"Relatorio_{rid}.pdf", pdf)
+            if progresso:
+                progresso(n)
+        if erros:
+            zf.writestr("erros.txt", "\n".join(f"{rid}: {erro}" for rid, erro in erros.items()))
+    return erros
+
+
+def exportar_pdf_unico(registros, destino, progresso=None):
+    """Todos os procedimentos num só PDF gravado em `destino` (caminho ou arquivo binário)."""
+    # O FPDF monta o documento inteiro antes de gravar: aqui não há como dividir entre processos
+    pdf = PDF()
+    for n, dados in enumerate(registros, 1):
+        escrever_registro(pdf, dados)
+        if progresso:
+            progresso(n)
+    if pdf.page == 0:
+        pdf.add_page()
+    conteudo = pdf.output(dest="S").encode("latin-1")
+    if isinstance(destino, (str, os.PathLike)):
+        with open(destino, "wb") as f:
+            f.write(conteudo)
+    else:
+        destino.write(conteudo)
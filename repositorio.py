@@ -0,0 +1,91 @@
+"""Camada de dados sem Streamlit: conexões, leitura e escrita instrumentadas, carga inicial e importação.
+
+Usada pelo app.py e pelos jobs em lote (cli.py), que assim não precisam subir o Streamlit.
+"""
+import os
+
+import pandas as pd
+
+from banco import ARQUIVO_DB, gerenciador, tabela_alvo
+from consultas import TABELAS_REFERENCIA
+from deduplicacao import LIMIAR, mesclar, sugerir
+from importador import ResultadoImportacao, importar_csv, importar_xlsx
+from metricas import coletor
+from migracoes import migrar
+
+PASTA = os.path.dirname(os.path.abspath(__file__))
+ARQUIVO_CSV = os.path.join(PASTA, 'dados.csv')
+ARQUIVO_XLSX = os.path.join(PASTA, 'MYVAL BRAZIL 2025.xlsx') # Usado na carga inicial quando não há CSV
+
+
+# Conexões compartilhadas pelo processo (pool de leitura + escritor único, em WAL)
+def get_db(): return gerenciador(ARQUIVO_DB)
+
+
+def run_action(query, params=(), depois=None):
+    try:
+        with get_db().escrita(invalida=[tabela_alvo(query)]) as conn:
+            with coletor.consulta(conn, query, params) as m:
+                cur = conn.execute(query, params)
+                m["linhas"] = cur.rowcount
+            if depois: depois(conn, cur)  # na mesma transação
+        return True, "Sucesso"
+    except Exception as e:
+        return False, str(e)
+
+
+def run_query(query, params=()):
+    with get_db().leitura() as conn, coletor.consulta(conn, query, params) as m:
+        df = pd.read_sql(query, conn, params=params)
+        m["linhas"] = len(df)
+    return df
+
+
+def iter_query(query, params=()):
+    # Linha a linha, como dict: para lotes grandes que não devem virar um DataFrame inteiro
+    with get_db().leitura() as conn:
+        with coletor.consulta(conn, query, params):  # só a execução; as linhas são consumidas aos poucos
+            cur = conn.execute(query, params)
+        cols = [c[0] for c in cur.description]
+        for linha in cur:
+            yield dict(zip(cols, linha))
+
+
+def inicializar_banco():
+    """Aplica as migrações e, com o banco vazio, faz a carga inicial (CSV, ou a planilha XLSX).
+
+    Devolve o ResultadoImportacao da carga (com sem_origem=True se o banco está vazio e
+    não há arquivo para importar), ou None se o banco já tinha dados.
+    """
+    with get_db().escrita() as conn:
+        migrar(conn)
+        # Carga inicial em lote, numa única transação
+        if conn.execute("SELECT count(*) FROM procedimentos").fetchone()[0] == 0:
+            if os.path.exists(ARQUIVO_CSV): return importar_csv(conn, ARQUIVO_CSV)
+            if os.path.exists(ARQUIVO_XLSX): return importar_xlsx(conn, ARQUIVO_XLSX)
+            return ResultadoImportacao(sem_origem=True)
+    return None
+
+
+def importar(arquivo, incremental=True, progresso=None):
+    """Importa um CSV ou XLSX (caminho ou arquivo enviado) numa transação.
+
+    progresso(aba, linhas) só é chamado para XLSX.
+    """
+    nome = getattr(arquivo, 'name', str(arquivo))
+    with get_db().escrita(invalida=TABELAS_REFERENCIA + ["procedimentos", "lotes"]) as conn:
+        if nome.lower().endswith(".xlsx"):
+            return importar_xlsx(conn, arquivo, incremental=incremental, progresso=progresso)
+        return importar_csv(conn, arquivo, incremental=incremental)
+
+
+def sugerir_duplicados(tabela, limiar=LIMIAR):
+    with get_db().leitura() as conn:
+        return sugerir(conn, tabela, limiar)
+
+
+def mesclar_duplicados(tabela, grupos):
+    """Mescla os grupos sugeridos numa única transação. Devolve quantos cadastros foram removidos."""
+    with get_db().escrita(invalida=TABELAS_REFERENCIA + ["procedimentos"]) as conn:
+        migrar(conn)  # mesclagens vem da v8; no-op se o banco já está em dia
+        return mesclar(conn, tabela, grupos)